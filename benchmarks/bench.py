@@ -0,0 +1,323 @@
+# SPDX-License-Identifier: BSD-3-Clause
+"""
+Benchmarks of the hot paths of the simulation, on synthetic scenarios with bots
+that do nothing, so that only the engine is timed.
+
+    python benchmarks/bench.py                 # quick suite
+    python benchmarks/bench.py --full          # up to 20k units and 40 players
+    python benchmarks/bench.py --save          # store the results as the baseline
+    python benchmarks/bench.py --check         # fail if slower than the baseline
+
+The throughput is reported in time steps (or calls) per second, and in units
+times time steps per second for the benchmarks that scale with the number of
+units. The baseline is only meaningful on the machine where it was saved, so it
+is not part of the repository: save it locally (e.g. on the main branch) before
+checking a change.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from functools import partial
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pyglet
+
+# Images are rendered off-screen
+pyglet.options["headless"] = True
+
+from supremacy import config, scenario  # noqa: E402
+from supremacy.config import _make_colors  # noqa: E402
+from supremacy.engine import Engine  # noqa: E402
+from supremacy.fight import fight  # noqa: E402
+from supremacy.game_map import GameMap  # noqa: E402
+from supremacy.scenario import IdleBot  # noqa: E402
+
+BASELINE = Path(__file__).parent / "baseline.json"
+
+SUITES = {
+    "quick": {
+        "units": [100, 2000],
+        "players": [2, 10],
+        "maps": [(1720, 1020)],
+    },
+    "full": {
+        "units": [100, 1000, 5000, 20000],
+        "players": [2, 10, 40],
+        "maps": [(1720, 1020), (2560, 1440), (3840, 2160)],
+    },
+}
+
+
+@contextlib.contextmanager
+def no_cache():
+    previous = os.environ.get("SUPREMACY_CACHE_DIR")
+    os.environ["SUPREMACY_CACHE_DIR"] = ""
+    try:
+        yield
+    finally:
+        if previous is None:
+            del os.environ["SUPREMACY_CACHE_DIR"]
+        else:
+            os.environ["SUPREMACY_CACHE_DIR"] = previous
+
+
+def make_engine(nunits: int, nplayers: int, seed: int = 1) -> Engine:
+    """
+    A headless game with ``nplayers`` players with one base each, and ``nunits``
+    vehicles spread at random over the map. No unit can die, so that repeating a
+    time step always does the same amount of work.
+    """
+    players = {f"p{i}": {} for i in range(nplayers)}
+    spec = {"seed": seed, "players": players}
+    game_map = scenario.terrain(spec)
+    rng = np.random.default_rng(seed)
+    cells = {
+        "tanks": np.flatnonzero(game_map == 1),
+        "ships": np.flatnonzero(game_map == 0),
+        "jets": np.arange(game_map.size),
+    }
+    owners = list(players.values())
+    for i, kind in enumerate(rng.choice(list(cells), size=nunits)):
+        cell = cells[kind][rng.integers(len(cells[kind]))]
+        owners[i % nplayers].setdefault(kind, []).append(
+            {
+                "x": (cell % game_map.shape[1]) + rng.random(),
+                "y": (cell // game_map.shape[1]) + rng.random(),
+                "heading": rng.uniform(0, 360),
+            }
+        )
+    engine = scenario.build(spec)
+    engine.units.health[: engine.units.size] = 10**9
+    return engine
+
+
+def bench_fight(engine: Engine) -> Callable:
+    health = engine.units.health.copy()
+
+    def step():
+        engine.units.health[:] = health
+        fight(units=engine.units, batch=None)
+
+    return step
+
+
+def bench_generate_info(engine: Engine) -> Callable:
+    def step():
+        # The snapshot of the armies is rebuilt once per time step
+        engine.tick += 1
+        for player in engine.players.values():
+            engine.generate_info(player)
+
+    return step
+
+
+def bench_move(engine: Engine) -> Callable:
+    return partial(engine.move, engine.dt)
+
+
+def bench_fog(engine: Engine) -> Callable:
+    moved = engine.move(engine.dt)
+    team = engine.units.team[moved]
+    slots = {p.team: moved[team == p.number] for p in engine.players.values()}
+
+    def step():
+        for player in engine.players.values():
+            player.update_player_map(
+                x=engine.units.x[slots[player.team]],
+                y=engine.units.y[slots[player.team]],
+            )
+
+    return step
+
+
+def bench_income(engine: Engine) -> Callable:
+    return partial(engine.init_dt, 100.0)
+
+
+def bench_tick(engine: Engine) -> Callable:
+    def step():
+        with contextlib.redirect_stdout(io.StringIO()):
+            engine.update(engine.dt)
+
+    return step
+
+
+ENGINE_BENCHMARKS = {
+    "fight": bench_fight,
+    "generate_info": bench_generate_info,
+    "move": bench_move,
+    "fog": bench_fog,
+    "income": bench_income,
+    "tick": bench_tick,
+}
+
+
+def bench_game_map(nx: int, ny: int, nplayers: int) -> Callable:
+    config.nx, config.ny = nx, ny
+    config.headless = True
+    ais = {f"p{i}": None for i in range(nplayers)}
+
+    def step():
+        np.random.seed(1)
+        with no_cache():
+            game_map = GameMap(nx=nx, ny=ny)
+            game_map.add_players(players=ais)
+
+    return step
+
+
+def bench_images(nplayers: int) -> Callable:
+    colors = _make_colors({f"p{i}": IdleBot(f"p{i}") for i in range(nplayers)})
+    config.nx, config.ny = 1720, 1020
+
+    def step():
+        with no_cache():
+            config.setup(colors=colors, headless=False)
+
+    return step
+
+
+def measure(step: Callable, min_time: float, min_repeats: int = 3) -> float:
+    """
+    The median duration of a call to ``step``, after one warm-up call.
+    """
+    step()
+    times = []
+    start = time.perf_counter()
+    while (len(times) < min_repeats) or (time.perf_counter() - start < min_time):
+        t0 = time.perf_counter()
+        step()
+        times.append(time.perf_counter() - t0)
+    return float(np.median(times))
+
+
+def make_cases(suite: dict) -> List[Tuple[str, dict]]:
+    cases = []
+    for name in ENGINE_BENCHMARKS:
+        if name == "income":
+            # The income only depends on the number of bases
+            sizes = [(100, p) for p in suite["players"]]
+        else:
+            sizes = [(n, 10) for n in suite["units"]]
+            sizes += [(2000, p) for p in suite["players"] if p != 10]
+        for nunits, nplayers in sizes:
+            cases.append((name, {"units": nunits, "players": nplayers}))
+    for nx, ny in suite["maps"]:
+        cases.append(("game_map", {"nx": nx, "ny": ny, "players": 10}))
+    for nplayers in suite["players"]:
+        cases.append(("images", {"players": nplayers}))
+    return cases
+
+
+def run_case(name: str, params: dict, min_time: float) -> dict:
+    np.random.seed(1)
+    if name in ENGINE_BENCHMARKS:
+        engine = make_engine(nunits=params["units"], nplayers=params["players"])
+        step = ENGINE_BENCHMARKS[name](engine)
+    elif name == "game_map":
+        step = bench_game_map(params["nx"], params["ny"], params["players"])
+    else:
+        step = bench_images(params["players"])
+    try:
+        duration = measure(step, min_time=min_time)
+    finally:
+        config.headless = True
+    result = {"per_second": 1 / duration}
+    if ("units" in params) and (name != "income"):
+        result["units_per_second"] = params["units"] / duration
+    return result
+
+
+def case_key(name: str, params: dict) -> str:
+    return name + "[" + ",".join(f"{k}={v}" for k, v in params.items()) + "]"
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> List[str]:
+    """
+    The names of the cases that are slower than the baseline by more than
+    ``tolerance`` (as a fraction of the baseline throughput).
+    """
+    slower = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        ratio = result["per_second"] / baseline[key]["per_second"]
+        print(f"{key:<45} {ratio:6.2f}x baseline")
+        if ratio < 1 - tolerance:
+            slower.append(key)
+    return slower
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Supremacy benchmarks")
+    parser.add_argument("--full", action="store_true", help="Run the full sweep")
+    parser.add_argument("--filter", default="", help="Only run matching cases")
+    parser.add_argument(
+        "--min-time", type=float, default=1.0, help="Seconds to time each case"
+    )
+    parser.add_argument("--output", type=Path, help="Write the results to a file")
+    parser.add_argument("--save", action="store_true", help="Update the baseline")
+    parser.add_argument(
+        "--check", action="store_true", help="Compare the results to the baseline"
+    )
+    parser.add_argument(
+        "--baseline", type=Path, default=BASELINE, help="Path to the baseline"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Allowed slowdown compared to the baseline (default: 0.25)",
+    )
+    args = parser.parse_args(argv)
+    if args.check and not args.baseline.exists():
+        print(f"No baseline in {args.baseline}: run with --save first")
+        return 2
+
+    results: Dict[str, dict] = {}
+    suite = SUITES["full" if args.full else "quick"]
+    for name, params in make_cases(suite):
+        key = case_key(name, params)
+        if args.filter not in key:
+            continue
+        try:
+            results[key] = run_case(name, params, min_time=args.min_time)
+        except Exception as error:
+            # Rendering the images needs an OpenGL context, which is not always
+            # available on a headless machine
+            if name != "images":
+                raise
+            print(f"{key:<45} skipped: {error!r}")
+            continue
+        line = f"{key:<45} {results[key]['per_second']:12.1f} /s"
+        if "units_per_second" in results[key]:
+            line += f" {results[key]['units_per_second']:14.0f} units/s"
+        print(line, flush=True)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    baseline = {}
+    if args.baseline.exists():
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump({**baseline, **results}, f, indent=2)
+    if args.check:
+        slower = compare(results, baseline, tolerance=args.tolerance)
+        if slower:
+            print("Slower than the baseline:", ", ".join(slower))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
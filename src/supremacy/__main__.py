@@ -1,4 +1,5 @@
 import argparse
+import sys
 from pathlib import Path
 import tomllib
 
@@ -7,13 +8,17 @@ from supremacy.bots import load_bots
 
 
 def main():
+    commands = {"replay": replay, "tournament": tournament}
+    if (len(sys.argv) > 1) and (sys.argv[1] in commands):
+        return commands[sys.argv[1]](sys.argv[2:])
     args = parse_arguments()
     config = load_config(args.config)
     bots = load_bots(config)
+    supremacy.start(players=bots, **engine_options(config["supremacy"]))
 
-    cfg = config["supremacy"]
-    supremacy.start(
-        players=bots,
+
+def engine_options(cfg):
+    return dict(
         time_limit=cfg.get("time-limit", 300),
         fullscreen=cfg.get("fullscreen", False),
         high_contrast=cfg.get("high-contrast", False),
@@ -22,7 +27,65 @@ def main():
         test=cfg.get("test", True),
         safe=cfg.get("safe", False),
         super_crystal=cfg.get("super-crystal", False),
+        headless=cfg.get("headless", False),
+        fixed_timestep=cfg.get("fixed-timestep", False),
+        parallel=cfg.get("parallel", False),
+        tick_budget=cfg.get("tick-budget", None),
+        match_budget=cfg.get("match-budget", None),
+        replay=cfg.get("replay", None),
+        profile=cfg.get("profile", False),
+    )
+
+
+def tournament(argv):
+    from supremacy.tournament import run_tournament
+
+    parser = argparse.ArgumentParser(
+        prog="supremacy tournament",
+        description="Play many headless Supremacy matches in parallel",
+    )
+    parser.add_argument(
+        "config",
+        type=Path,
+        nargs="?",
+        default="config-tournament.toml",
+        help="Path to config file",
+    )
+    parser.add_argument("--rounds", type=int, help="Number of rounds")
+    parser.add_argument("--processes", type=int, help="Number of matches at once")
+    args = parser.parse_args(argv)
+    config = load_config(args.config)
+    cfg = config.get("tournament", {})
+    seeds = cfg.get("seeds", None)
+    if (seeds is None) and ("seed" in config["supremacy"]):
+        seeds = [config["supremacy"]["seed"]]
+    run_tournament(
+        players=load_bots(config),
+        options=engine_options(config["supremacy"]),
+        rounds=args.rounds or cfg.get("rounds", 1),
+        seeds=seeds,
+        group_size=cfg.get("group-size", None),
+        processes=args.processes or cfg.get("processes", None),
+        output_dir=cfg.get("output", "tournament"),
+    )
+
+
+def replay(argv):
+    from supremacy.replay import play
+
+    parser = argparse.ArgumentParser(
+        prog="supremacy replay", description="Watch a recorded Supremacy match"
+    )
+    parser.add_argument("file", type=Path, help="Path to the replay file")
+    parser.add_argument(
+        "--speed", type=float, default=1.0, help="Playback speed (default: 1)"
+    )
+    parser.add_argument(
+        "--start", type=float, default=0, help="Start time in seconds (default: 0)"
     )
+    parser.add_argument("--fullscreen", action="store_true", help="Fullscreen window")
+    args = parser.parse_args(argv)
+    play(args.file, speed=args.speed, start=args.start, fullscreen=args.fullscreen)
 
 
 def parse_arguments():
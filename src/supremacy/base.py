@@ -1,15 +1,16 @@
 # SPDX-License-Identifier: BSD-3-Clause
 
 import uuid
-from typing import Any
+from typing import Any, Optional, Tuple
 
 import numpy as np
 import pyglet
 
 
 from . import config
-from .tools import distance_on_plane, distance_on_torus, wrap_position
-from .vehicles import Jet, Ship, Tank, VehicleProxy
+from .tools import InfoView, distance_on_plane, distance_on_torus, wrap_position
+from .units import UnitStore
+from .vehicles import Jet, Ship, Tank
 
 
 class Base:
@@ -22,21 +23,27 @@ class Base:
         batch: Any,
         owner: Any,
         uid: str,
+        units: UnitStore,
         high_contrast: bool = False,
     ):
-        self.x = x
-        self.y = y
-        self.screen_x = x * config.scaling
-        self.screen_y = y * config.scaling
-        self._as_info = None
+        self._proxy = None
         self.kind = "base"
-        self.health = config.health["base"]
-        self.attack = config.attack["base"]
         self.team = team
         self.number = number
         self.owner = owner
         self.batch = batch
         self.uid = uid
+        self.units = units
+        self._units = units
+        self.slot = units.add(
+            self,
+            kind=self.kind,
+            team=number,
+            x=x,
+            y=y,
+            health=config.health["base"],
+            attack=config.attack["base"],
+        )
         self.competing = False
         self.high_contrast = high_contrast
         muid = uuid.uuid4().hex
@@ -48,12 +55,13 @@ class Base:
                 number=self.number,
                 owner=self,
                 uid=muid,
+                units=self.units,
             )
         }
         self.crystal = 0
         self.owner.update_player_map(x=self.x, y=self.y)
         self.avatar = None
-        if self.high_contrast:
+        if self.high_contrast and (not config.headless):
             rgb = config.colors[self.number]
             self.shape = pyglet.shapes.Rectangle(
                 x=self.screen_x - (config.competing_mine_radius * config.scaling),
@@ -70,102 +78,111 @@ class Base:
         self.clabel = None
         self.make_avatar()
 
-        ix = int(x)
-        iy = int(y)
-        dx = config.vehicle_offset
-        offset = None
-        while offset is None:
-            xx, yy = wrap_position(ix + dx, iy + dx)
-            if self.owner.game_map[yy, xx] == 1:
-                offset = (dx, dx)
-                break
-            xx, yy = wrap_position(ix + dx, iy - dx)
-            if self.owner.game_map[yy, xx] == 1:
-                offset = (dx, -dx)
-                break
-            xx, yy = wrap_position(ix - dx, iy + dx)
-            if self.owner.game_map[yy, xx] == 1:
-                offset = (-dx, dx)
-                break
-            xx, yy = wrap_position(ix - dx, iy - dx)
-            if self.owner.game_map[yy, xx] == 1:
-                offset = (-dx, -dx)
-                break
-            dx += 1
-        self.tank_offset = offset
-
-        dx = config.vehicle_offset
-        offset = None
-        while offset is None:
-            xx, yy = wrap_position(ix + dx, iy + dx)
-            if self.owner.game_map[yy, xx] == 0:
-                offset = (dx, dx)
-                break
-            xx, yy = wrap_position(ix + dx, iy - dx)
-            if self.owner.game_map[yy, xx] == 0:
-                offset = (dx, -dx)
-                break
-            xx, yy = wrap_position(ix - dx, iy + dx)
-            if self.owner.game_map[yy, xx] == 0:
-                offset = (-dx, dx)
-                break
-            xx, yy = wrap_position(ix - dx, iy - dx)
-            if self.owner.game_map[yy, xx] == 0:
-                offset = (-dx, -dx)
-                break
-            dx += 1
-        self.ship_offset = offset
+        self.tank_offset = self.find_offset(x=int(x), y=int(y), terrain=1)
+        self.ship_offset = self.find_offset(x=int(x), y=int(y), terrain=0)
+
+    def find_offset(self, x: int, y: int, terrain: int) -> Tuple[int, int]:
+        """
+        The offset from (x, y) of the closest pixel of the given terrain along the
+        diagonals, which is where the vehicles that move on that terrain are built.
+        """
+        game_map = self.owner.original_map_array
+        for dx in range(config.vehicle_offset, max(config.nx, config.ny)):
+            for offset in ((dx, dx), (dx, -dx), (-dx, dx), (-dx, -dx)):
+                xx, yy = wrap_position(x + offset[0], y + offset[1])
+                if game_map[yy, xx] == terrain:
+                    return offset
+        raise ValueError(
+            f"No {'land' if terrain == 1 else 'water'} found around the base at "
+            f"({x}, {y})"
+        )
+
+    @property
+    def x(self) -> int:
+        return int(self._units.x[self.slot])
+
+    @property
+    def y(self) -> int:
+        return int(self._units.y[self.slot])
+
+    @property
+    def screen_x(self) -> float:
+        return self.x * config.scaling
+
+    @property
+    def screen_y(self) -> float:
+        return self.y * config.scaling
+
+    @property
+    def attack(self) -> int:
+        return int(self._units.attack[self.slot])
+
+    @property
+    def health(self) -> int:
+        return int(self._units.health[self.slot])
+
+    @health.setter
+    def health(self, value: int):
+        self._units.health[self.slot] = value
 
     def make_avatar(self):
-        if self.health <= 0:
+        if config.headless or (self.health <= 0):
+            return
+        images = (
+            config.images[f"base_{self.number}{'_C' if self.competing else ''}"],
+            config.images[f"health_{self.health}"],
+            config.images[f"mines_{len(self.mines)}"],
+        )
+        if self.avatar is not None:
+            self.avatar.image = images[0]
+            self.health_label.image = images[1]
+            self.mines_label.image = images[2]
             return
-        if self.health_label is not None:
-            self.avatar.delete()
-            self.health_label.delete()
-            self.mines_label.delete()
         self.avatar = pyglet.sprite.Sprite(
-            img=config.images[f"base_{self.number}{'_C' if self.competing else ''}"],
-            x=self.screen_x,
-            y=self.screen_y,
-            batch=self.batch,
+            img=images[0], x=self.screen_x, y=self.screen_y, batch=self.batch
         )
         self.health_label = pyglet.sprite.Sprite(
-            img=config.images[f"health_{self.health}"],
+            img=images[1],
             x=self.screen_x - (6 * config.scaling),
             y=self.screen_y + (18 * config.scaling),
             batch=self.batch,
         )
         self.mines_label = pyglet.sprite.Sprite(
-            img=config.images[f"mines_{len(self.mines)}"],
+            img=images[2],
             x=self.screen_x + (18 * config.scaling),
             y=self.screen_y + (18 * config.scaling),
             batch=self.batch,
         )
 
     def delete(self):
-        self.avatar.delete()
-        self.health_label.delete()
-        self.mines_label.delete()
+        if self.avatar is not None:
+            self.avatar.delete()
+            self.health_label.delete()
+            self.mines_label.delete()
         if self.shape is not None:
             self.shape.delete()
+        for mine in self.mines.values():
+            mine.delete()
+        self._units = self._units.detach(self.slot)
+        self.slot = 0
 
-    def reset_info(self):
-        self._as_info = None
+    def snapshot(self, units: UnitStore, slot: int) -> "BaseSnapshot":
+        """
+        The view of the base given to the other players, which reads its state from
+        ``units``, a frozen copy of the store.
+        """
+        return BaseSnapshot(self, units=units, slot=slot)
+
+    def proxy(self) -> "BaseProxy":
+        """
+        The view of the base given to its owner, which can also build with it.
+        """
+        if self._proxy is None:
+            self._proxy = BaseProxy(self)
+        return self._proxy
 
     def as_info(self) -> dict:
-        if self._as_info is None:
-            self._as_info = {
-                "x": self.x,
-                "y": self.y,
-                "team": self.team,
-                "number": self.number,
-                "mines": len(self.mines),
-                "crystal": self.crystal,
-                "uid": self.uid,
-                "position": self.get_position(),
-                "health": self.health,
-            }
-        return self._as_info
+        return dict(BaseInfo(self).items())
 
     def mine_cost(self) -> int:
         return config.cost["mine"] * (2 ** (len(self.mines) - 1))
@@ -188,11 +205,17 @@ class Base:
         self.crystal -= self.mine_cost()
         uid = uuid.uuid4().hex
         self.mines[uid] = Mine(
-            x=self.x, y=self.y, team=self.team, number=self.number, owner=self, uid=uid
+            x=self.x,
+            y=self.y,
+            team=self.team,
+            number=self.number,
+            owner=self,
+            uid=uid,
+            units=self.units,
         )
         self.make_avatar()
 
-    def build_tank(self, heading: float) -> str:
+    def build_tank(self, heading: float, uid: Optional[str] = None) -> str:
         """
         Build a tank at this base.
         Returns the uid of the tank.
@@ -201,11 +224,14 @@ class Base:
         ----------
         heading : float
             The initial heading of the tank in degrees.
+        uid : str, optional
+            The uid to give to the tank. By default, a new one is made.
         """
         if self.not_enough_crystal("tank"):
             return
         print(f"Player {self.team} is building a TANK at {self.x}, {self.y}")
-        uid = uuid.uuid4().hex
+        if uid is None:
+            uid = uuid.uuid4().hex
         tank = Tank(
             x=self.x + self.tank_offset[0],
             y=self.y + self.tank_offset[1],
@@ -215,12 +241,13 @@ class Base:
             batch=self.batch,
             owner=self,
             uid=uid,
+            units=self.units,
         )
         self.owner.tanks[uid] = tank
         self.crystal -= config.cost["tank"]
-        return VehicleProxy(tank)
+        return tank.proxy()
 
-    def build_ship(self, heading: float) -> str:
+    def build_ship(self, heading: float, uid: Optional[str] = None) -> str:
         """
         Build a ship at this base.
         Returns the uid of the ship.
@@ -229,11 +256,14 @@ class Base:
         ----------
         heading : float
             The initial heading of the ship in degrees.
+        uid : str, optional
+            The uid to give to the ship. By default, a new one is made.
         """
         if self.not_enough_crystal("ship"):
             return
         print(f"Player {self.team} is building a SHIP at {self.x}, {self.y}")
-        uid = uuid.uuid4().hex
+        if uid is None:
+            uid = uuid.uuid4().hex
         ship = Ship(
             x=self.x + self.ship_offset[0],
             y=self.y + self.ship_offset[1],
@@ -243,12 +273,13 @@ class Base:
             batch=self.batch,
             owner=self,
             uid=uid,
+            units=self.units,
         )
         self.owner.ships[uid] = ship
         self.crystal -= config.cost["ship"]
-        return VehicleProxy(ship)
+        return ship.proxy()
 
-    def build_jet(self, heading: float) -> str:
+    def build_jet(self, heading: float, uid: Optional[str] = None) -> str:
         """
         Build a jet at this base.
         Returns the uid of the jet.
@@ -257,11 +288,14 @@ class Base:
         ----------
         heading : float
             The initial heading of the jet in degrees.
+        uid : str, optional
+            The uid to give to the jet. By default, a new one is made.
         """
         if self.not_enough_crystal("jet"):
             return
         print(f"Player {self.team} is building a JET at {self.x}, {self.y}")
-        uid = uuid.uuid4().hex
+        if uid is None:
+            uid = uuid.uuid4().hex
         jet = Jet(
             x=self.x,
             y=self.y,
@@ -271,10 +305,11 @@ class Base:
             batch=self.batch,
             owner=self,
             uid=uid,
+            units=self.units,
         )
         self.owner.jets[uid] = jet
         self.crystal -= config.cost["jet"]
-        return VehicleProxy(jet)
+        return jet.proxy()
 
     def get_distance(self, x: float, y: float, shortest=True) -> float:
         """
@@ -305,29 +340,80 @@ class Base:
         return np.array([self.x, self.y])
 
 
-class BaseProxy:
-    def __init__(self, base):
-        self._data = base.as_info()
-        for key, item in self._data.items():
-            setattr(self, key, item)
-        self.build_mine = base.build_mine
-        self.build_tank = base.build_tank
-        self.build_ship = base.build_ship
-        self.build_jet = base.build_jet
-        self.mine_cost = base.mine_cost
-        self.get_distance = base.get_distance
+class BaseInfo(InfoView):
+    __slots__ = ("_base",)
+    _keys = (
+        "x",
+        "y",
+        "team",
+        "number",
+        "mines",
+        "crystal",
+        "uid",
+        "position",
+        "health",
+    )
+
+    def __init__(self, base: Base):
+        self._base = base
+
+    @property
+    def x(self) -> int:
+        return self._base.x
+
+    @property
+    def y(self) -> int:
+        return self._base.y
+
+    @property
+    def team(self) -> str:
+        return self._base.team
 
-    def __getitem__(self, key):
-        return self._data[key]
+    @property
+    def number(self) -> int:
+        return self._base.number
 
-    def keys(self):
-        return self._data.keys()
+    @property
+    def mines(self) -> int:
+        return len(self._base.mines)
 
-    def values(self):
-        return self._data.values()
+    @property
+    def crystal(self) -> float:
+        return self._base.crystal
 
-    def items(self):
-        return self._data.items()
+    @property
+    def uid(self) -> str:
+        return self._base.uid
+
+    @property
+    def position(self) -> np.ndarray:
+        return self._base.get_position()
+
+    @property
+    def health(self) -> int:
+        return self._base.health
+
+
+class BaseProxy(BaseInfo):
+    __slots__ = ()
+
+    def build_mine(self):
+        return self._base.build_mine()
+
+    def build_tank(self, heading: float):
+        return self._base.build_tank(heading)
+
+    def build_ship(self, heading: float):
+        return self._base.build_ship(heading)
+
+    def build_jet(self, heading: float):
+        return self._base.build_jet(heading)
+
+    def mine_cost(self) -> int:
+        return self._base.mine_cost()
+
+    def get_distance(self, x: float, y: float, shortest=True) -> float:
+        return self._base.get_distance(x, y, shortest=shortest)
 
     def cost(self, kind):
         if kind == "mine":
@@ -338,17 +424,94 @@ class BaseProxy:
 
 class Mine:
     def __init__(
-        self, x: float, y: float, team: str, number: int, owner: Base, uid: str
+        self,
+        x: float,
+        y: float,
+        team: str,
+        number: int,
+        owner: Base,
+        uid: str,
+        units: UnitStore,
     ):
-        self.x = x
-        self.y = y
         self.team = team
         self.number = number
         self.owner = owner
-        self.health = config.health["mine"]
-        self.attack = config.attack["mine"]
         self.kind = "mine"
         self.uid = uid
+        self._units = units
+        self.slot = units.add(
+            self,
+            kind=self.kind,
+            team=number,
+            x=x,
+            y=y,
+            health=config.health["mine"],
+            attack=config.attack["mine"],
+        )
+
+    @property
+    def x(self) -> int:
+        return int(self._units.x[self.slot])
+
+    @property
+    def y(self) -> int:
+        return int(self._units.y[self.slot])
+
+    @property
+    def attack(self) -> int:
+        return int(self._units.attack[self.slot])
+
+    @property
+    def health(self) -> int:
+        return int(self._units.health[self.slot])
+
+    @health.setter
+    def health(self, value: int):
+        self._units.health[self.slot] = value
 
     def make_avatar(self):
         return
+
+    def delete(self):
+        self._units = self._units.detach(self.slot)
+        self.slot = 0
+
+
+class BaseSnapshot(BaseInfo):
+    """
+    The view of a base as it was when the store was frozen, so that keeping it does
+    not let the other players follow the base once it is back under the fog of war.
+    """
+
+    __slots__ = ("_units", "_slot", "_mines", "_crystal")
+
+    def __init__(self, base: Base, units: UnitStore, slot: int):
+        self._base = base
+        self._units = units
+        self._slot = slot
+        self._mines = len(base.mines)
+        self._crystal = base.crystal
+
+    @property
+    def x(self) -> int:
+        return int(self._units.x[self._slot])
+
+    @property
+    def y(self) -> int:
+        return int(self._units.y[self._slot])
+
+    @property
+    def mines(self) -> int:
+        return self._mines
+
+    @property
+    def crystal(self) -> float:
+        return self._crystal
+
+    @property
+    def position(self) -> np.ndarray:
+        return np.array([self.x, self.y])
+
+    @property
+    def health(self) -> int:
+        return int(self._units.health[self._slot])
@@ -1,6 +1,9 @@
 # SPDX-License-Identifier: BSD-3-Clause
 
-from typing import Any, List, Tuple
+import hashlib
+import os
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
 import importlib_resources as ir
 import numpy as np
@@ -14,8 +17,11 @@ from .bots import Bot
 
 # MAX_HEALTH = 100
 
+# Bump when the way the images are made changes, to invalidate the cached images
+IMAGE_CACHE_VERSION = 1
 
-def _recenter_image(img: pyglet.image.ImageData) -> pyglet.image.ImageData:
+
+def _recenter_image(img: "pyglet.image.ImageData") -> "pyglet.image.ImageData":
     img.anchor_x = img.width // 2
     img.anchor_y = img.height // 2
     return img
@@ -25,26 +31,63 @@ def scale_image(img: Image, scale: float) -> Image:
     return img.resize((int(img.width * scale), int(img.height * scale)))
 
 
-def _to_image(img: Image) -> pyglet.image.ImageData:
+def _to_image(img: Union[Image.Image, np.ndarray]) -> "pyglet.image.ImageData":
+    data = np.ascontiguousarray(img)
     return _recenter_image(
         pyglet.image.ImageData(
-            width=img.width,
-            height=img.height,
+            width=data.shape[1],
+            height=data.shape[0],
             fmt="RGBA",
-            data=img.tobytes(),
-            pitch=-img.width * 4,
+            data=data.tobytes(),
+            pitch=-data.shape[1] * 4,
         )
     )
 
 
-def _make_base_image(resources: Any, name: str, rgb: Tuple[float, ...]) -> Image:
-    img = Image.open(resources / f"{name}.png")
-    img = img.convert("RGBA")
-    data = img.getdata()
-    new_data = np.array(data).reshape(img.height, img.width, 4)
-    for i in range(3):
-        new_data[..., i] = int(round(rgb[i] * 255))
-    return Image.fromarray(new_data.astype(np.uint8))
+def _load_template(resources: Any, name: str) -> np.ndarray:
+    return np.array(Image.open(resources / f"{name}.png").convert("RGBA"))
+
+
+def _tint(template: np.ndarray, rgb: Tuple[float, ...]) -> np.ndarray:
+    img = template.copy()
+    img[..., :3] = [int(round(c * 255)) for c in rgb[:3]]
+    return img
+
+
+def _draw_text(img: np.ndarray, text: str, font: Any) -> np.ndarray:
+    """
+    Draw black text in the middle of the image.
+    """
+    pil = Image.fromarray(img)
+    ImageDraw.Draw(pil).text(
+        (pil.width / 2, pil.height / 2), text, fill=(0, 0, 0), font=font, anchor="mm"
+    )
+    return np.array(pil)
+
+
+def _scale(img: np.ndarray, scale: float) -> np.ndarray:
+    return np.array(scale_image(Image.fromarray(img), scale))
+
+
+def cache_dir(name: str) -> Optional[Path]:
+    """
+    The directory where the generated data called ``name`` is cached, created if
+    needed. The cache is in ``~/.cache/supremacy`` by default. This can be changed
+    with the ``SUPREMACY_CACHE_DIR`` environment variable, and setting it to an
+    empty string disables the cache, in which case ``None`` is returned.
+    """
+    root = os.environ.get("SUPREMACY_CACHE_DIR")
+    if root is None:
+        base = os.environ.get("XDG_CACHE_HOME") or (Path.home() / ".cache")
+        root = Path(base) / "supremacy"
+    elif not root:
+        return None
+    path = Path(root) / name
+    try:
+        path.mkdir(parents=True, exist_ok=True)
+    except OSError:
+        return None
+    return path
 
 
 def _make_colors(players: dict[str, Bot]) -> List[Tuple[float, ...]]:
@@ -71,13 +114,21 @@ class Config:
         self.scoreboard_width = 200
         self.taskbar_height = 60
         self.fps = 15
+        self.headless = False
         self.resources = ir.files("supremacy") / "resources"
         file = font_manager.findfont("sans")
+        self.font_file = file
         self.small_font = ImageFont.truetype(file, size=10)
         self.large_font = ImageFont.truetype(file, size=16)
         self.medium_font = ImageFont.truetype(file, size=12)
 
-    def initialize(self, players: dict[str, Bot], fullscreen=False):
+    def initialize(
+        self,
+        players: dict[str, Bot],
+        fullscreen=False,
+        headless=False,
+        map_size: Optional[Tuple[int, int]] = None,
+    ):
         dy = self.taskbar_height * (not fullscreen)
         ref_nx = 1920 - self.scoreboard_width
         ref_ny = 1080 - dy
@@ -87,81 +138,172 @@ class Config:
         ratio = ref_nx / ref_ny
         self.nx = min(max(int(np.sqrt(area * ratio)), ref_nx), max_nx)
         self.ny = min(max(int(np.sqrt(area / ratio)), ref_ny), max_ny)
+        if map_size is not None:
+            self.nx, self.ny = map_size
+        self.setup(
+            colors=_make_colors(players), fullscreen=fullscreen, headless=headless
+        )
+
+    def setup(
+        self,
+        colors: List[Tuple[float, ...]],
+        fullscreen: bool = False,
+        headless: bool = False,
+    ):
+        """
+        Set the scaling and generate the images for the current map size. This is
+        also used by the replay viewer, which gets the map size and the colors of
+        the players from the replay file.
+        """
+        self.colors = colors
+        self.headless = headless
+        if self.headless:
+            # No window and no sprites: only the colors are needed for the outputs
+            self.scaling = 1.0
+            self.images = {}
+            return
 
+        pyglet.font.add_file(self.font_file)
+        dy = self.taskbar_height * (not fullscreen)
         display = pyglet.canvas.Display()
         screen = display.get_default_screen()
         screen_width = screen.width - self.scoreboard_width
         screen_height = screen.height - dy
         self.scaling = min(min(screen_width / self.nx, screen_height / self.ny), 1.0)
 
-        self.generate_images(players)
+        self.generate_images()
 
-    def generate_images(self, players: dict[str, Bot]):
-        img = Image.open(self.resources / "explosion.png")
-        self.images = {"explosion": _to_image(scale_image(img, self.scaling))}
-        self.colors = _make_colors(players)
-        for n in range(len(players)):
-            rgb = self.colors[n]
-            self.generate_vehicle_images(n, rgb)
-            self.generate_base_images(n, rgb)
-            self.generate_dead_images(n, rgb)
+    def generate_images(self):
+        """
+        Make the sprites for all the players. The images are cached on disk, under
+        a hash of everything they are made from: the resources, the fonts, the
+        scaling and the player colors.
+        """
+        self.images = {}
+        for name, img in self.cached_images(None, self.render_shared_images).items():
+            self.images[name] = _to_image(img)
+        for n, rgb in enumerate(self.colors):
+            images = self.cached_images(rgb, self.render_player_images)
+            for name, img in images.items():
+                kind, _, suffix = name.partition("_")
+                key = f"{kind}_{n}" + (f"_{suffix}" if suffix else "")
+                self.images[key] = _to_image(img)
+        self.pack_images()
 
-    def generate_vehicle_images(self, n: int, rgb: tuple):
-        for name in ("jet", "ship", "tank"):
-            for health in range(0, self.health[name] + 1, 10):
-                img = _make_base_image(self.resources, name, rgb)
-                d = ImageDraw.Draw(img)
-                d.text(
-                    (img.width / 2, img.height / 2),
-                    str(health),
-                    fill=(0, 0, 0),
-                    font=self.small_font,
-                    anchor="mm",
-                )
-                self.images[f"{name}_{n}_{health}"] = _to_image(
-                    scale_image(img, self.scaling)
-                )
+    def pack_images(self):
+        # Put all the sprite images in a few large textures. Changing the image of
+        # a sprite then only changes its texture coordinates, and the batch draws
+        # all the units without switching textures. Each image is padded with a
+        # copy of its edges, so that it is filtered exactly as a separate texture.
+        self.atlas = pyglet.image.atlas.TextureBin()
+        for name, img in self.images.items():
+            if isinstance(img, pyglet.image.ImageData):
+                data = np.frombuffer(
+                    img.get_data("RGBA", img.width * 4), dtype=np.uint8
+                ).reshape(img.height, img.width, 4)
+                padded = np.pad(data, ((1, 1), (1, 1), (0, 0)), mode="edge")
+                region = self.atlas.add(
+                    pyglet.image.ImageData(
+                        width=img.width + 2,
+                        height=img.height + 2,
+                        fmt="RGBA",
+                        data=padded.tobytes(),
+                        pitch=(img.width + 2) * 4,
+                    )
+                ).get_region(1, 1, img.width, img.height)
+                region.anchor_x = img.anchor_x
+                region.anchor_y = img.anchor_y
+                self.images[name] = region
 
-    def generate_base_images(self, n: int, rgb: tuple):
-        name = "base"
-        img = _make_base_image(self.resources, name, rgb)
-        self.images[f"player_{n}"] = scale_image(img, self.scaling)
-        self.images[f"{name}_{n}"] = _to_image(scale_image(img, self.scaling))
-        d = ImageDraw.Draw(img)
-        d.text(
-            (img.width / 2, img.height / 2),
-            "C",
-            fill=(0, 0, 0),
-            font=self.large_font,
-            anchor="mm",
+    def image_cache_key(self, rgb: Optional[Tuple[float, ...]]) -> str:
+        digest = hashlib.sha256()
+        for name in ("base", "explosion", "jet", "ship", "skull", "tank"):
+            digest.update((self.resources / f"{name}.png").read_bytes())
+        digest.update(
+            repr(
+                (
+                    IMAGE_CACHE_VERSION,
+                    self.small_font.getname(),
+                    self.medium_font.getname(),
+                    self.large_font.getname(),
+                    sorted(self.health.items()),
+                    self.scaling,
+                    None if rgb is None else tuple(float(c) for c in rgb),
+                )
+            ).encode()
         )
-        self.images[f"{name}_{n}_C"] = _to_image(scale_image(img, self.scaling))
+        return digest.hexdigest()
 
-        for health in range(0, self.health["base"] + 1, 10):
-            img = Image.new("RGBA", (24, 24), (0, 0, 0, 0))
-            d = ImageDraw.Draw(img)
-            d.text(
-                (img.width / 2, img.height / 2),
-                f"{health}",
-                fill=(0, 0, 0),
-                font=self.medium_font,
-                anchor="mm",
+    def cached_images(
+        self,
+        rgb: Optional[Tuple[float, ...]],
+        render: Callable[..., Dict[str, np.ndarray]],
+    ) -> Dict[str, np.ndarray]:
+        directory = cache_dir("images")
+        if directory is None:
+            return render(rgb)
+        path = directory / f"{self.image_cache_key(rgb)}.npz"
+        # All the images are packed in a single array, which is much faster to
+        # load than one array per image
+        try:
+            with np.load(path) as data:
+                names, shapes, pixels = data["names"], data["shapes"], data["pixels"]
+            ends = np.cumsum(np.prod(shapes, axis=1))
+            return {
+                str(name): pixels[end - np.prod(shape) : end].reshape(shape)
+                for name, shape, end in zip(names, shapes, ends)
+            }
+        except (OSError, KeyError, ValueError):
+            pass
+        images = render(rgb)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            with open(tmp, "wb") as f:
+                np.savez(
+                    f,
+                    names=np.array(list(images)),
+                    shapes=np.array([img.shape for img in images.values()]),
+                    pixels=np.concatenate([img.ravel() for img in images.values()]),
+                )
+            os.replace(tmp, path)
+        except OSError:
+            pass
+        return images
+
+    def render_shared_images(self, rgb: None) -> Dict[str, np.ndarray]:
+        """
+        The images that are the same for all the players.
+        """
+        images = {
+            "explosion": _scale(
+                _load_template(self.resources, "explosion"), self.scaling
             )
-            self.images[f"health_{health}"] = _to_image(scale_image(img, self.scaling))
+        }
+        blank = np.zeros((24, 24, 4), dtype=np.uint8)
+        for health in range(0, self.health["base"] + 1, 10):
+            img = _draw_text(blank, f"{health}", self.medium_font)
+            images[f"health_{health}"] = _scale(img, self.scaling)
         for mines in range(0, 20):
-            img = Image.new("RGBA", (24, 24), (0, 0, 0, 0))
-            d = ImageDraw.Draw(img)
-            d.text(
-                (img.width / 2, img.height / 2),
-                f"[{mines}]",
-                fill=(0, 0, 0),
-                font=self.medium_font,
-                anchor="mm",
-            )
-            self.images[f"mines_{mines}"] = _to_image(scale_image(img, self.scaling))
+            img = _draw_text(blank, f"[{mines}]", self.medium_font)
+            images[f"mines_{mines}"] = _scale(img, self.scaling)
+        return images
 
-    def generate_dead_images(self, n: int, rgb: tuple):
-        name = "skull"
-        self.images[f"{name}_{n}"] = scale_image(
-            _make_base_image(self.resources, name, rgb), self.scaling
+    def render_player_images(self, rgb: Tuple[float, ...]) -> Dict[str, np.ndarray]:
+        """
+        The images of the vehicles (for every health value), the base and the skull
+        in the color of a player.
+        """
+        images = {}
+        for name in ("jet", "ship", "tank"):
+            img = _tint(_load_template(self.resources, name), rgb)
+            for health in range(0, self.health[name] + 1, 10):
+                images[f"{name}_{health}"] = _scale(
+                    _draw_text(img, str(health), self.small_font), self.scaling
+                )
+        img = _tint(_load_template(self.resources, "base"), rgb)
+        images["base"] = _scale(img, self.scaling)
+        images["base_C"] = _scale(_draw_text(img, "C", self.large_font), self.scaling)
+        images["skull"] = _scale(
+            _tint(_load_template(self.resources, "skull"), rgb), self.scaling
         )
+        return images
@@ -3,20 +3,24 @@
 import importlib
 import os
 import time
-from typing import Dict, Optional
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
 import pyglet
 from matplotlib.colors import to_hex
 
 from . import config
-from .base import BaseProxy
 from .fight import fight
-from .game_map import GameMap, MapView
+from .game_map import BaseLocations, GameMap
 from .graphics import Graphics
+from .navigation import Navigation
 from .player import Player
-from .tools import ReadOnly
-from .vehicles import Vehicle, VehicleProxy
+from .profiler import NullProfiler, TickProfiler
+from .replay import ReplayRecorder
+from .scenario import populate
+from .tools import wrap_position
+from .units import KIND_IDS, UnitStore
+from .workers import BotWorker
 
 
 class Engine:
@@ -31,19 +35,52 @@ class Engine:
         seed: Optional[int] = None,
         fullscreen: bool = False,
         super_crystal: bool = False,
+        headless: bool = False,
+        fixed_timestep: bool = False,
+        parallel: bool = False,
+        tick_budget: Optional[float] = None,
+        match_budget: Optional[float] = None,
+        replay: Optional[str] = None,
+        output_dir: str = ".",
+        profile: bool = False,
+        map_size: Optional[Tuple[int, int]] = None,
+        scenario: Optional[dict] = None,
+        autostart: bool = True,
     ):
         if seed is not None:
             np.random.seed(seed)
 
-        config.initialize(players=players, fullscreen=fullscreen)
+        config.initialize(
+            players=players,
+            fullscreen=fullscreen,
+            headless=headless,
+            map_size=map_size,
+        )
 
         self.nx = config.nx
         self.ny = config.ny
         self.time_limit = time_limit
+        self.output_dir = output_dir
         self.start_time = None
+        # The simulation clock: with a fixed timestep, time is counted in ticks of
+        # dt and does not depend on how fast the host machine runs the game
+        self.fixed_timestep = fixed_timestep or headless
+        self.dt = 1 / config.fps
+        self.tick = 0
         self.scores = self.read_scores(players=players, test=test)
         self.dead_players = []
         self.high_contrast = high_contrast
+        self.headless = headless
+        self.parallel = parallel
+        self.tick_budget = tick_budget
+        self.match_budget = match_budget
+        self.seed = seed
+        self.replay = replay
+        self.recorder = None
+        self.profile = profile
+        self.profiler = NullProfiler()
+        self.scenario = scenario
+        self.workers = {}
         self.safe = safe
         self.player_ais = {player.name: player.factory() for player in players.values()}
         self.players = {}
@@ -55,21 +92,52 @@ class Engine:
         self.pause_time = 0
         self.exiting = False
         self.time_of_last_scoreboard_update = 0
+        self._snapshot = None
+        self._snapshot_key = None
 
         self.game_map = GameMap(
             nx=self.nx,
             ny=self.ny,
             high_contrast=self.high_contrast,
             super_crystal=self._super_crystal,
+            seed=seed,
         )
-        self.graphics = Graphics(engine=self, fullscreen=fullscreen)
+        if self.headless:
+            self.graphics = None
+            self.batch = None
+        else:
+            self.graphics = Graphics(engine=self, fullscreen=fullscreen)
+            self.batch = self.graphics.main_batch
         self.setup()
+        # Without autostart, the game is set up but the caller advances it, with
+        # run() or update(), e.g. to benchmark or test parts of a time step
+        if autostart:
+            self.run()
 
-        pyglet.clock.schedule_interval(self.update, 1 / config.fps)
-        pyglet.app.run()
+    def run(self):
+        try:
+            if self.headless:
+                # Advance the game as fast as possible, without a window or event
+                # loop
+                while not self.exiting:
+                    self.update(self.dt)
+            else:
+                pyglet.clock.schedule_interval(self.update, 1 / config.fps)
+                pyglet.app.run()
+        finally:
+            # Also when an AI crashes the game, whose replay is the most useful
+            for worker in self.workers.values():
+                worker.close()
+            if self.recorder is not None:
+                self.recorder.close()
+                print(f"Replay saved to {self.replay}")
 
     def setup(self):
-        self.base_locations = np.zeros((self.ny, self.nx), dtype=int)
+        self.base_locations = BaseLocations(
+            nx=self.nx, ny=self.ny, radius=config.competing_mine_radius
+        )
+        self.units = UnitStore()
+        self.navigation = Navigation(self.game_map.array)
         player_locations = self.game_map.add_players(players=self.player_ais)
         self.players = {}
         for i, (name, ai_factory) in enumerate(self.player_ais.items()):
@@ -80,11 +148,46 @@ class Engine:
                 location=player_locations[p.team],
                 number=i,
                 team=p.team,
-                batch=self.graphics.main_batch,
+                batch=self.batch,
                 game_map=self.game_map.array,
                 score=self.scores[p.team],
                 high_contrast=self.high_contrast,
                 base_locations=self.base_locations,
+                units=self.units,
+                navigation=self.navigation,
+                tick_budget=self.tick_budget,
+                match_budget=self.match_budget,
+            )
+        if self.scenario is not None:
+            populate(players=self.players, spec=self.scenario)
+        if self.parallel:
+            self.workers = {
+                name: BotWorker(
+                    ai_factory=self.player_ais[name],
+                    team=name,
+                    game_map=p.game_map.array,
+                    navigation=self.navigation,
+                    safe=self.safe,
+                )
+                for name, p in self.players.items()
+            }
+            # Wait for the processes to start and make their AIs, so that this
+            # does not count towards the time of the first turn
+            for name, worker in self.workers.items():
+                *_, error = worker.collect()
+                if error is not None:
+                    self.players[name].watchdog.record_error(error)
+        if self.profile:
+            self.profiler = TickProfiler(teams=list(self.players))
+        if self.replay is not None:
+            self.recorder = ReplayRecorder(
+                path=self.replay,
+                game_map=self.game_map,
+                teams=list(self.players),
+                colors=config.colors,
+                dt=self.dt,
+                seed=self.seed,
+                high_contrast=self.high_contrast,
             )
         self.make_player_avatars()
 
@@ -99,7 +202,7 @@ class Engine:
 
     def read_scores(self, players: dict, test: bool) -> Dict[str, int]:
         scores = {}
-        fname = "scores.txt"
+        fname = os.path.join(self.output_dir, "scores.txt")
         if os.path.exists(fname) and (not test):
             with open(fname, "r") as f:
                 contents = f.readlines()
@@ -111,45 +214,112 @@ class Engine:
         print("Scores:", scores)
         return scores
 
-    def move(self, vehicle: Vehicle, dt: float):
-        x, y = vehicle.next_position(dt=dt)
-        map_value = self.game_map.array[int(y), int(x)]
-        vehicle.move(x, y, map_value=map_value)
+    def move(self, dt: float) -> np.ndarray:
+        """
+        Move all the vehicles that are not stopped in one go, and return their slots.
+        Tanks can only move onto land, ships only onto water, and jets anywhere.
+        """
+        units = self.units
+        slots = units.active()
+        kind = units.kind[slots]
+        slots = slots[
+            (kind != KIND_IDS["base"])
+            & (kind != KIND_IDS["mine"])
+            & (~units.stopped[slots])
+        ]
+        kind = units.kind[slots]
+        h = units.heading[slots] * np.pi / 180.0
+        x, y = wrap_position(
+            units.x[slots] + np.cos(h) * units.speed[slots] * dt,
+            units.y[slots] + np.sin(h) * units.speed[slots] * dt,
+        )
+        map_values = self.game_map.array[y.astype(int), x.astype(int)]
+        allowed = (
+            ((kind == KIND_IDS["tank"]) & (map_values == 1))
+            | ((kind == KIND_IDS["ship"]) & (map_values == 0))
+            | (kind == KIND_IDS["jet"])
+        )
+        units.previous_x[slots] = units.x[slots]
+        units.previous_y[slots] = units.y[slots]
+        moved = slots[allowed]
+        units.x[moved] = x[allowed]
+        units.y[moved] = y[allowed]
+        if not self.headless:
+            for slot in moved:
+                units.objects[slot].move_avatar()
+        return slots
+
+    def army_snapshot(self) -> Tuple[list, np.ndarray, np.ndarray, UnitStore, list]:
+        """
+        Gather all the bases and vehicles with their integer positions, in the order
+        of the players' armies (by team, kind and age), along with a frozen copy of
+        their state and the views of them given to the other players. The views are
+        made when first needed. The snapshot is shared by all observers, and only
+        rebuilt when units have moved, been added or removed.
+        """
+        key = (self.tick, self.units.version)
+        if self._snapshot_key != key:
+            units = self.units
+            slots = units.active()
+            slots = slots[units.kind[slots] != KIND_IDS["mine"]]
+            slots = units.army_order(slots)
+            self._snapshot = (
+                [units.objects[slot] for slot in slots],
+                units.x[slots].astype(int),
+                units.y[slots].astype(int),
+                units.freeze(slots),
+                [None] * len(slots),
+            )
+            self._snapshot_key = key
+        return self._snapshot
 
     def generate_info(self, player: Player):
-        info = {}
-        for n, p in [(n, p) for n, p in self.players.items() if not p.dead]:
-            info[n] = {"bases": [], "tanks": [], "ships": [], "jets": []}
-            army = list(p.army)
-            xy = np.array([(v.y, v.x) for v in army]).astype(int)
-            inds = np.where(player.game_map.array[(xy[:, 0], xy[:, 1])] != -1)[0]
-            for ind in inds:
-                v = army[ind]
-                info[n][f"{v.kind}s"].append(
-                    (BaseProxy(v) if v.kind == "base" else VehicleProxy(v))
-                    if player.team == n
-                    else ReadOnly(v.as_info())
-                )
-            for key in list(info[n].keys()):
-                if len(info[n][key]) == 0:
-                    del info[n][key]
+        info = {n: {} for n, p in self.players.items() if not p.dead}
+        army, ix, iy, frozen, views = self.army_snapshot()
+        visible = np.flatnonzero(player.game_map.array[iy, ix] != -1)
+        for ind in visible.tolist():
+            v = army[ind]
+            key = f"{v.kind}s"
+            if key not in info[v.team]:
+                info[v.team][key] = []
+            if player.team == v.team:
+                info[v.team][key].append(v.proxy())
+            else:
+                # The units of the other players are seen as they are now
+                if views[ind] is None:
+                    views[ind] = v.snapshot(frozen, ind)
+                info[v.team][key].append(views[ind])
         return info
 
+    def collect_commands(self, t: float, players: List[Player]):
+        """
+        Apply the commands of the AIs running in parallel, in the order of the
+        players. With a tick budget, the workers get that much wall time in total
+        to finish: the AIs that are late lose their turn, and their results are
+        discarded.
+        """
+        start = time.perf_counter()
+        for player in players:
+            timeout = None
+            if self.tick_budget is not None:
+                timeout = start + self.tick_budget - time.perf_counter()
+            result = self.workers[player.team].collect(timeout=timeout)
+            if result is None:
+                player.watchdog.miss()
+                continue
+            commands, used, wall, error = result
+            self.profiler.record_bot(player.team, wall=wall, cpu=used)
+            player.watchdog.record(t=t, used=used)
+            if error is not None:
+                player.watchdog.record_error(error)
+            player.execute_commands(commands)
+            player.collect_transformed_ships()
+
     def init_dt(self, t: float):
-        min_distance = config.competing_mine_radius
-        base_locs = MapView(self.base_locations)
         for player in self.players.values():
             player.init_dt()
-            for base in player.bases.values():
-                base.reset_info()
-                nbases = sum(
-                    [
-                        view.sum()
-                        for view in base_locs.view(
-                            x=base.x, y=base.y, dx=min_distance, dy=min_distance
-                        )
-                    ]
-                )
+            for uid, base in player.bases.items():
+                nbases = self.base_locations.count(uid)
                 multiplier = (
                     29
                     * int(self.game_map._super_crystal == (int(base.x), int(base.y)))
@@ -159,7 +329,7 @@ class Engine:
                     self.crystal_boost
                     * multiplier
                     * 2
-                    * (30.0 / config.fps)
+                    * (30.0 * self.dt)
                     * len(base.mines)
                     / nbases
                 )
@@ -167,7 +337,11 @@ class Engine:
                 base.competing = nbases > 1
                 if before != base.competing:
                     base.make_avatar()
-        if abs(t - self.time_of_last_scoreboard_update) > 1:
+
+    def update_scoreboard(self, t: float):
+        if (self.graphics is not None) and (
+            abs(t - self.time_of_last_scoreboard_update) > 1
+        ):
             self.time_of_last_scoreboard_update = t
             self.graphics.update_scoreboard(t=t)
 
@@ -186,19 +360,23 @@ class Engine:
                 self.players.values(), key=lambda x: x.global_score, reverse=True
             )
         ]
-        fname = "scores.txt"
+        fname = os.path.join(self.output_dir, "scores.txt")
         with open(fname, "w") as f:
             for name, p in self.players.items():
                 f.write(f"{name}: {p.global_score}\n")
         for i, (name, score) in enumerate(sorted_scores):
             print(f"{i + 1}. {name}: {score}")
+        print("AI timings (CPU time):")
+        for name, p in self.players.items():
+            print(f"  {name}: {p.watchdog.summary()}")
 
     def finalize(self):
+        self.profiler.dump(self.output_dir)
         # Dump player maps
         for p in self.players.values():
-            p.dump_map()
+            p.dump_map(self.output_dir)
         # Create a html page with all the player maps as a grid
-        with open("maps.html", "w") as f:
+        with open(os.path.join(self.output_dir, "maps.html"), "w") as f:
             f.write(
                 "<html><head><style>img {width: 100%; height: auto;}</style></head>"
             )
@@ -220,6 +398,8 @@ class Engine:
 
     def update(self, dt: float):
         if self.exiting:
+            if self.graphics is None:
+                return
             if self.graphics.exit_message is None:
                 self.graphics.show_exit_message()
             return
@@ -232,44 +412,93 @@ class Engine:
         else:
             if self.previously_paused:
                 self.previously_paused = False
-                self.time_limit += time.time() - self.pause_time
-                for name, ai in self.player_ais.items():
-                    importlib.reload(ai)
-                    new_ai = ai.PlayerAi()
-                    new_ai.team = name
-                    self.players[new_ai.team].ai = new_ai
+                if not self.fixed_timestep:
+                    self.time_limit += time.time() - self.pause_time
+                if self.parallel:
+                    # The AIs run in the worker processes, which keep their code
+                    print("Reloading the AIs is not supported in parallel mode")
+                else:
+                    for name, ai in self.player_ais.items():
+                        importlib.reload(ai)
+                        new_ai = ai.PlayerAi()
+                        new_ai.team = name
+                        self.players[new_ai.team].ai = new_ai
 
-        if self.start_time is None:
-            self.start_time = time.time()
-        t = time.time() - self.start_time
+        if self.fixed_timestep:
+            dt = self.dt
+            t = self.tick * self.dt
+        else:
+            if self.start_time is None:
+                self.start_time = time.time()
+            t = time.time() - self.start_time
+        self.tick += 1
+        profiler = self.profiler
+        profiler.start_tick(self.tick)
         if t > self.time_limit:
             self.exit(message="Time limit reached!")
-        self.init_dt(self.time_limit - t)
+        with profiler.phase("income"):
+            self.init_dt(self.time_limit - t)
+        with profiler.phase("scoreboard"):
+            self.update_scoreboard(self.time_limit - t)
 
-        for key in list(self.explosions.keys()):
-            self.explosions[key].update()
-            if self.explosions[key].animate <= 0:
-                del self.explosions[key]
+        with profiler.phase("explosions"):
+            for key in list(self.explosions.keys()):
+                self.explosions[key].update()
+                if self.explosions[key].animate <= 0:
+                    del self.explosions[key]
 
-        for name, player in self.players.items():
-            if player.dead:
-                if player.animate_cross > 0:
-                    player.cross_animate()
-            else:
-                info = self.generate_info(player)
-                player.execute_ai(t=t, dt=dt, info=info, safe=self.safe)
-                player.collect_transformed_ships()
-        for name, player in self.players.items():
-            for v in player.vehicles:
-                v.reset_info()
-                if not v.stopped:
-                    self.move(v, dt)
-                    player.update_player_map(x=v.x, y=v.y)
+        submitted = []
+        with profiler.phase("bots"):
+            for name, player in self.players.items():
+                if player.dead:
+                    if player.animate_cross > 0:
+                        player.cross_animate()
+                elif self.parallel:
+                    worker = self.workers[name]
+                    if player.watchdog.allow(busy=not worker.ready(player.watchdog)):
+                        worker.submit(
+                            t=t,
+                            dt=dt,
+                            info=self.generate_info(player),
+                            game_map=player.game_map.array,
+                        )
+                        submitted.append(player)
+                else:
+                    info = self.generate_info(player)
+                    with profiler.bot(name):
+                        player.execute_ai(t=t, dt=dt, info=info, safe=self.safe)
+                    player.collect_transformed_ships()
+        if submitted:
+            with profiler.phase("collect"):
+                self.collect_commands(t=t, players=submitted)
+        with profiler.phase("move"):
+            moved = self.move(dt)
+        with profiler.phase("fog"):
+            team = self.units.team[moved]
+            for player in self.players.values():
+                if not player.dead:
+                    slots = moved[team == player.number]
+                    player.update_player_map(
+                        x=self.units.x[slots], y=self.units.y[slots]
+                    )
 
-        dead_vehicles, dead_bases, explosions = fight(
-            players={key: p for key, p in self.players.items() if not p.dead},
-            batch=self.graphics.main_batch,
-        )
+        profiler.count_units(self.units)
+        with profiler.phase("fight"):
+            dead_vehicles, dead_bases, explosions = fight(
+                units=self.units, batch=self.batch, profiler=profiler
+            )
+        with profiler.phase("deaths"):
+            self.remove_dead(dead_vehicles, dead_bases, explosions)
+        for name, worker in self.workers.items():
+            worker.pending_cells.append(self.players[name].map_delta)
+        if self.recorder is not None:
+            with profiler.phase("replay"):
+                self.recorder.record(
+                    units=self.units,
+                    scores=[p.global_score for p in self.players.values()],
+                )
+
+    def remove_dead(self, dead_vehicles: dict, dead_bases: dict, explosions: dict):
         self.explosions.update(explosions)
         for name in dead_vehicles:
             for uid in dead_vehicles[name]:
@@ -278,8 +507,7 @@ class Engine:
         for name in dead_bases:
             for uid in dead_bases[name]:
                 if uid in self.players[name].bases:
-                    b = self.players[name].bases[uid]
-                    self.base_locations[int(b.y), int(b.x)] = 0
+                    self.base_locations.remove(uid)
                     self.players[name].remove_base(uid)
             if len(self.players[name].bases) == 0:
                 print(f"Player {name} died!")
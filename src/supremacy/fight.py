@@ -6,46 +6,122 @@ import numpy as np
 import pyglet
 
 from . import config
+from .profiler import NullProfiler
 from .tools import distance_on_torus
+from .units import UnitStore
 
 
-def fight(players, batch: Any) -> Tuple[dict, dict, dict]:
-    troops = [child for player in players.values() for child in player.children]
-    n = len(troops)
-    x = np.array([child.x for child in troops])
-    y = np.array([child.y for child in troops])
-    x1 = np.broadcast_to(x, (n, n))
-    x2 = x1.T
-    y1 = np.broadcast_to(y, (n, n))
-    y2 = y1.T
-    dist = distance_on_torus(x1, y1, x2, y2)
-    attackers, defenders = np.where(dist < config.fight_radius)
+def find_pairs(
+    x: np.ndarray, y: np.ndarray, radius: float
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find all pairs (i, j) of positions that are closer than ``radius`` on the
+    torus. The pairs are sorted by i and then by j, which gives the same result as
+    ``np.where(dist < radius)`` on the full ``n x n`` distance matrix.
+
+    The positions are binned on a periodic grid whose cells are at least
+    ``radius`` wide, so only the 9 cells around each position need to be searched.
+    """
+    n = len(x)
+    ncx = max(int(config.nx // radius), 1)
+    ncy = max(int(config.ny // radius), 1)
+    cx = (x // (config.nx / ncx)).astype(int) % ncx
+    cy = (y // (config.ny / ncy)).astype(int) % ncy
+    cells = cy * ncx + cx
+    order = np.argsort(cells, kind="stable")
+    sorted_cells = cells[order]
+
+    inds = np.arange(n)
+    first = []
+    second = []
+    # On very small grids some neighbours are the same cell: only visit them once
+    for ox in np.unique(np.array([-1, 0, 1]) % ncx):
+        for oy in np.unique(np.array([-1, 0, 1]) % ncy):
+            neighbours = ((cy + oy) % ncy) * ncx + ((cx + ox) % ncx)
+            start = np.searchsorted(sorted_cells, neighbours, side="left")
+            counts = np.searchsorted(sorted_cells, neighbours, side="right") - start
+            offsets = np.arange(counts.sum()) - np.repeat(
+                np.cumsum(counts) - counts, counts
+            )
+            first.append(np.repeat(inds, counts))
+            second.append(order[np.repeat(start, counts) + offsets])
+    i = np.concatenate(first)
+    j = np.concatenate(second)
+
+    dist = distance_on_torus(x[j], y[j], x[i], y[i])
+    close = dist < radius
+    i = i[close]
+    j = j[close]
+    sort = np.lexsort((j, i))
+    return i[sort], j[sort]
+
+
+def fight(
+    units: UnitStore, batch: Any, profiler: Any = NullProfiler()
+) -> Tuple[dict, dict, dict]:
+    # The order of the troops decides which attacker gets the credit for a kill
+    slots = units.army_order(units.active())
+    troops = [units.objects[slot] for slot in slots]
+    n = len(slots)
+    x = units.x[slots]
+    y = units.y[slots]
+    team = units.team[slots]
+    attack = units.attack[slots]
+    health = units.health[slots]
+    attackers, defenders = find_pairs(x, y, radius=config.fight_radius)
+    enemies = team[attackers] != team[defenders]
+    attackers = attackers[enemies]
+    defenders = defenders[enemies]
+    profiler.count("fight_pairs", len(attackers))
+
+    # Every defender takes its hits in the order of the attackers. Group the hits
+    # by defender to accumulate the damage received up to and including each hit.
+    order = np.lexsort((attackers, defenders))
+    attackers = attackers[order]
+    defenders = defenders[order]
+    damage = attack[attackers]
+    cumulative = np.cumsum(damage)
+    group_start = np.ones(len(defenders), dtype=bool)
+    group_start[1:] = defenders[1:] != defenders[:-1]
+    group = np.cumsum(group_start) - 1
+    received = cumulative - (cumulative - damage)[group_start][group]
+    remaining = health[defenders] - received
+    # A hit only lands if the defender was still alive before it. The hit that
+    # brings the health down to zero is credited with the kill.
+    lands = (remaining + damage) > 0
+    kills = np.flatnonzero(lands & (remaining <= 0))
+    total_damage = np.bincount(
+        defenders[lands], weights=damage[lands], minlength=n
+    ).astype(int)
+    units.health[slots] = health - total_damage
+    for ind in np.flatnonzero(total_damage):
+        troops[ind].make_avatar()
+
     dead_vehicles = {}
     dead_bases = {}
     explosions = {}
-    for a_ind, d_ind in zip(attackers, defenders):
+    # Process the deaths in the order they would happen when going through the
+    # attackers one by one
+    kills = kills[np.lexsort((defenders[kills], attackers[kills]))]
+    for a_ind, d_ind in zip(attackers[kills], defenders[kills]):
         attacker = troops[a_ind]
         defender = troops[d_ind]
-        if (attacker.team != defender.team) and (defender.health > 0):
-            defender.health -= attacker.attack
-            if defender.health <= 0:
-                if defender.kind == "base":
-                    if defender.team not in dead_bases:
-                        dead_bases[defender.team] = []
-                    dead_bases[defender.team].append(defender.uid)
-                    attacker.owner.owner.update_score(1)
-                else:
-                    if defender.team not in dead_vehicles:
-                        dead_vehicles[defender.team] = []
-                    dead_vehicles[defender.team].append(defender.uid)
-                print(
-                    f"{defender.team}'s {defender.kind} was destroyed "
-                    f"by {attacker.team}'s {attacker.kind} at "
-                    f"{defender.x}, {defender.y}"
-                )
-                explosions[defender.uid] = Explosion(defender.x, defender.y, batch)
-            else:
-                defender.make_avatar()
+        if defender.kind == "base":
+            if defender.team not in dead_bases:
+                dead_bases[defender.team] = []
+            dead_bases[defender.team].append(defender.uid)
+            attacker.owner.owner.update_score(1)
+        else:
+            if defender.team not in dead_vehicles:
+                dead_vehicles[defender.team] = []
+            dead_vehicles[defender.team].append(defender.uid)
+        print(
+            f"{defender.team}'s {defender.kind} was destroyed "
+            f"by {attacker.team}'s {attacker.kind} at "
+            f"{defender.x}, {defender.y}"
+        )
+        if not config.headless:
+            explosions[defender.uid] = Explosion(defender.x, defender.y, batch)
     return dead_vehicles, dead_bases, explosions
 
 
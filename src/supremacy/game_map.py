@@ -1,122 +1,301 @@
 # SPDX-License-Identifier: BSD-3-Clause
 
-from typing import Any, List
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 
 import matplotlib as mpl
 import numpy as np
-from matplotlib.colors import Normalize
 from PIL import Image
 import pyglet
-from scipy.ndimage import gaussian_filter
+from scipy import fft, ndimage, sparse
+from scipy.sparse import csgraph
 
 from . import config
-from .config import scale_image
-from .tools import periodic_distances, wrap_position
+from .config import cache_dir, scale_image
+from .tools import distance_on_torus
+
+# Version of the contents of the map cache files
+MAP_CACHE_VERSION = 1
+# Water regions smaller than this (in pixels) are lakes, where bases cannot start
+OPEN_SEA_AREA = 100 * 100
+
+
+def gaussian_kernel(sigma: float, n: int, truncate: float = 4.0) -> np.ndarray:
+    """
+    The weights of a normalized gaussian kernel truncated at ``truncate`` standard
+    deviations, like the ones used by ``scipy.ndimage.gaussian_filter``, wrapped
+    around a periodic axis of length ``n``.
+    """
+    radius = int(truncate * sigma + 0.5)
+    x = np.arange(-radius, radius + 1)
+    weights = np.exp(-0.5 / sigma**2 * x**2)
+    weights /= weights.sum()
+    kernel = np.zeros(n)
+    np.add.at(kernel, x % n, weights)
+    return kernel
+
+
+def periodic_gaussian_filter(image: np.ndarray, sigma: float) -> np.ndarray:
+    """
+    Gaussian filter with periodic boundaries, equivalent to
+    ``scipy.ndimage.gaussian_filter(image, sigma, mode="wrap")`` but computed as a
+    separable FFT convolution in single precision.
+    """
+    ny, nx = image.shape
+    kx = fft.rfft(gaussian_kernel(sigma, nx).astype(np.float32))
+    ky = fft.rfft(gaussian_kernel(sigma, ny).astype(np.float32))
+    out = fft.rfft(image.astype(np.float32), axis=1, workers=-1)
+    out = fft.irfft(out * kx, n=nx, axis=1, workers=-1)
+    out = fft.rfft(out, axis=0, workers=-1)
+    return fft.irfft(out * ky[:, None], n=ny, axis=0, workers=-1)
+
+
+def periodic_label(mask: np.ndarray) -> Tuple[np.ndarray, int]:
+    """
+    Label the connected regions of ``mask`` on the torus: regions touching opposite
+    edges of the map are joined. Returns the labels, where 0 is the background,
+    and the number of regions.
+    """
+    labels, n = ndimage.label(mask)
+    pairs = np.concatenate(
+        [
+            np.stack([labels[:, 0], labels[:, -1]], axis=1),
+            np.stack([labels[0, :], labels[-1, :]], axis=1),
+        ]
+    )
+    pairs = pairs[(pairs > 0).all(axis=1)]
+    graph = sparse.coo_matrix(
+        (np.ones(len(pairs)), (pairs[:, 0], pairs[:, 1])), shape=(n + 1, n + 1)
+    )
+    _, roots = csgraph.connected_components(graph, directed=False)
+    # The background is a component on its own, keep it as label 0
+    _, relabel = np.unique(roots[1:], return_inverse=True)
+    relabel = np.concatenate([[0], relabel + 1])
+    return relabel[labels], int(relabel.max())
+
+
+def read_only(array: np.ndarray) -> np.ndarray:
+    """
+    A view of the array that cannot be written to. The array itself can still be
+    modified, and the changes are seen through the view.
+    """
+    view = array.view()
+    view.flags.writeable = False
+    return view
+
+
+def find_shoreline(array: np.ndarray) -> np.ndarray:
+    # Same as where np.gradient is non-zero along any of the axes
+    shoreline = np.zeros(array.shape, dtype=bool)
+    for axis in (0, 1):
+        a = np.moveaxis(array, axis, 0)
+        s = np.moveaxis(shoreline, axis, 0)
+        s[1:-1] |= a[2:] != a[:-2]
+        s[0] |= a[1] != a[0]
+        s[-1] |= a[-1] != a[-2]
+    return shoreline
+
+
+def make_background_image(
+    array: np.ndarray, shoreline: np.ndarray, relief: np.ndarray, high_contrast: bool
+) -> "pyglet.image.ImageData":
+    if high_contrast:
+        to_image = np.flipud(array.astype(np.uint8) * 255)
+        to_image = np.broadcast_to(
+            to_image.reshape(to_image.shape + (1,)), to_image.shape + (3,)
+        )
+    else:
+        cmap = mpl.colormaps["terrain"]
+        colors = (cmap(np.arange(cmap.N))[:, :3] * 255).astype(np.uint8)
+        to_image = colors[np.flipud(relief)]
+        to_image[np.flipud(shoreline)] = (0, 140, 240)
+
+    img = scale_image(Image.fromarray(to_image), config.scaling)
+    return pyglet.image.ImageData(
+        width=img.width,
+        height=img.height,
+        fmt="RGB",
+        data=img.tobytes(),
+        pitch=-img.width * 3,
+    )
 
 
 class GameMap:
     def __init__(
-        self, nx: int, ny: int, high_contrast: bool = False, super_crystal: bool = False
+        self,
+        nx: int,
+        ny: int,
+        high_contrast: bool = False,
+        super_crystal: bool = False,
+        seed: Optional[int] = None,
     ):
         self.nx = nx
         self.ny = ny
-        image = np.zeros([self.ny, self.nx])
-        self.nseeds = int((nx * ny) * 200 / (1920 * 1080))
+        # Maps generated from a seed are cached on disk, along with the state of
+        # the random number generator at the end of the generation
+        cache = None
+        if seed is not None:
+            np.random.seed(seed)
+            directory = cache_dir("maps")
+            if directory is not None:
+                cache = directory / (
+                    f"map_v{MAP_CACHE_VERSION}_{seed}_{nx}x{ny}_"
+                    f"{int(super_crystal)}.npz"
+                )
+        if not self.load(cache):
+            self.generate(super_crystal=super_crystal)
+            self.save(cache)
+        self.shore_j, self.shore_i = np.where(self.shoreline)
+
+        if config.headless:
+            self.background_image = None
+        else:
+            self.background_image = make_background_image(
+                array=self.array,
+                shoreline=self.shoreline,
+                relief=self.relief,
+                high_contrast=high_contrast,
+            )
+
+    def generate(self, super_crystal: bool):
+        self.nseeds = int((self.nx * self.ny) * 200 / (1920 * 1080))
         self.xseed = np.random.randint(self.nx, size=self.nseeds)
         self.yseed = np.random.randint(self.ny, size=self.nseeds)
 
+        image = np.zeros([self.ny, self.nx], dtype=np.float32)
         image[(self.yseed, self.xseed)] = 10000
-
-        smooth = gaussian_filter(image, sigma=30, mode="wrap")
-
-        self.array = np.clip(smooth, 0, 1).astype(int)
-        cmap = mpl.colormaps["terrain"]
-        norm = Normalize()
+        smooth = periodic_gaussian_filter(image, sigma=30)
+        self.array = np.clip(smooth, 0, 1).astype(np.int8)
+        self.refine_coast(smooth, sigma=30)
+        # The smoothed terrain, as indices in the 256 colors of the colormap used
+        # for the background image
+        low = smooth.min()
+        high = smooth.max()
+        self.relief = np.minimum(
+            ((smooth - low) / max(high - low, 1e-30)) * 256, 255
+        ).astype(np.uint8)
 
         # Find shoreline indices
-        gy, gx = np.gradient(self.array)
-        contour = np.abs(gy) + np.abs(gx)
-        self.shoreline = contour > 0
-        self.shore_j, self.shore_i = np.where(self.shoreline)
-
-        if high_contrast:
-            to_image = np.flipud(self.array * 255)
-            to_image = np.broadcast_to(
-                to_image.reshape(to_image.shape + (1,)), to_image.shape + (3,)
-            )
-        else:
-            ii = np.flipud(
-                np.broadcast_to(
-                    self.shoreline.reshape(self.shoreline.shape + (1,)),
-                    self.shoreline.shape + (3,),
-                )
-            )
-            to_image = cmap(norm(np.flipud(smooth)))[..., :3] * 255
-            contour_color = np.full_like(to_image, (0, 140, 240))
-            to_image[ii] = contour_color[ii]
+        self.shoreline = find_shoreline(self.array)
+        shore_j, shore_i = np.where(self.shoreline)
 
         if super_crystal:
             # Select a single random pixel on the shoreline for super crystal
-            ind = np.random.randint(len(self.shore_i))
-            self._super_crystal = (self.shore_i[ind], self.shore_j[ind])
+            ind = np.random.randint(len(shore_i))
+            self._super_crystal = (shore_i[ind], shore_j[ind])
         else:
             self._super_crystal = (None, None)
 
-        img = scale_image(Image.fromarray(to_image.astype(np.uint8)), config.scaling)
-        self.background_image = pyglet.image.ImageData(
-            width=img.width,
-            height=img.height,
-            fmt="RGB",
-            data=img.tobytes(),
-            pitch=-img.width * 3,
+    def refine_coast(self, smooth: np.ndarray, sigma: float):
+        # The land starts where the smoothed terrain reaches 1. Recompute the cells
+        # close to that level exactly, so that the rounding errors of the FFT never
+        # move the coast compared to a direct convolution.
+        near = np.flatnonzero(np.abs(smooth - 1) < 1e-4)
+        if len(near) == 0:
+            return
+        seeds = np.unique(self.yseed * self.nx + self.xseed)
+        dx = (near % self.nx)[:, None] - seeds % self.nx
+        dy = (near // self.nx)[:, None] - seeds // self.nx
+        wx = gaussian_kernel(sigma, self.nx)[dx % self.nx]
+        wy = gaussian_kernel(sigma, self.ny)[dy % self.ny]
+        self.array.flat[near] = 10000 * (wx * wy).sum(axis=1) >= 1
+
+    def load(self, path: Optional[Path]) -> bool:
+        if (path is None) or (not path.exists()):
+            return False
+        try:
+            with np.load(path) as data:
+                self.array = data["array"].astype(np.int8)
+                self.relief = data["relief"]
+                self.xseed = data["xseed"]
+                self.yseed = data["yseed"]
+                crystal = tuple(data["super_crystal"])
+                state = (
+                    "MT19937",
+                    data["rng_keys"],
+                    int(data["rng_pos"]),
+                    int(data["rng_has_gauss"]),
+                    float(data["rng_cached_gaussian"]),
+                )
+        except (OSError, KeyError, ValueError):
+            return False
+        self.nseeds = len(self.xseed)
+        self.shoreline = find_shoreline(self.array)
+        self._super_crystal = (None, None) if crystal[0] < 0 else crystal
+        np.random.set_state(state)
+        return True
+
+    def save(self, path: Optional[Path]):
+        if path is None:
+            return
+        _, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+        crystal = (
+            self._super_crystal if self._super_crystal[0] is not None else (-1, -1)
         )
+        # Write to a temporary file first, so that other processes never read a
+        # partially written map
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            with open(tmp, "wb") as f:
+                np.savez_compressed(
+                    f,
+                    array=self.array,
+                    relief=self.relief,
+                    xseed=self.xseed,
+                    yseed=self.yseed,
+                    super_crystal=np.array(crystal),
+                    rng_keys=keys,
+                    rng_pos=pos,
+                    rng_has_gauss=has_gauss,
+                    rng_cached_gaussian=cached_gaussian,
+                )
+            os.replace(tmp, path)
+        except OSError:
+            pass
 
-    def add_players(self, players: dict):
-        locations = {}
-        niter = 0
-        for n, player in enumerate(players):
-            not_set = True
-            while not_set:
-                niter += 1
-                if niter > 50:
-                    raise RuntimeError("Could not find a suitable location for a base")
-
-                # Select a single random pixel on the shoreline for player base
-                ind = np.random.randint(len(self.shore_i))
-                i = self.shore_i[ind]
-                j = self.shore_j[ind]
-
-                not_set = False
-                for loc in locations.values():
-                    dist = periodic_distances(i, j, loc[0], loc[1])[0].min()
-                    if dist < 5 * config.competing_mine_radius:
-                        not_set = True
-                # Do not start base on super crystal
-                if (i, j) == self._super_crystal:
-                    not_set = True
-                # Check for lakes
-                if not not_set:
-                    # Ray-trace from (i, j) in 64 directions and find maximum distance
-                    # to land (array value of 1)
-                    thetas = np.linspace(0, 2 * np.pi, 64)
-                    vectors = np.array([np.sin(thetas), np.cos(thetas)]).T
-                    distance = np.linspace(0, config.ny, config.ny)
-                    rays = vectors.reshape(vectors.shape + (1,)) * distance
-                    rays[:, 0, :] += j
-                    rays[:, 1, :] += i
-                    x, y = wrap_position(
-                        rays[:, 1, :].astype(int), rays[:, 0, :].astype(int)
-                    )
-                    map_values = self.array[y, x]
-                    max_dists = np.argmax(map_values, axis=1)
-                    max_map_values = np.max(map_values, axis=1)
-                    w = np.where(max_map_values == 1)
-                    distmax = max_dists[w].max()
-                    if distmax < 100:
-                        not_set = True
-
-            locations[player] = (i, j)
+    def base_candidates(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The positions where a player can start: on the coast of the open sea, i.e.
+        water regions of at least ``OPEN_SEA_AREA`` pixels, and away from the super
+        crystal.
+        """
+        water = self.array == 0
+        labels, _ = periodic_label(water)
+        open_sea = np.bincount(labels.ravel()) >= OPEN_SEA_AREA
+        open_sea[0] = False
+        candidates = self.shoreline & open_sea[labels]
+        if not candidates.any():
+            candidates = self.shoreline & water
+        y, x = np.nonzero(candidates)
+        if self._super_crystal[0] is not None:
+            far = (
+                distance_on_torus(x, y, *self._super_crystal)
+                >= config.competing_mine_radius
+            )
+            x, y = x[far], y[far]
+        return x, y
 
+    def add_players(self, players: dict) -> Dict[str, Tuple[int, int]]:
+        """
+        Choose the starting locations of all the players in one pass. They are
+        drawn at random among the candidates that are at least
+        ``5 * config.competing_mine_radius`` away from the bases already placed. If
+        there are no such candidates left, the one furthest from all the other
+        bases is used instead.
+        """
+        x, y = self.base_candidates()
+        order = np.random.permutation(len(x))
+        x = x[order]
+        y = y[order]
+        min_distance = 5 * config.competing_mine_radius
+        distance = np.full(len(x), np.inf)
+        locations = {}
+        for player in players:
+            far_enough = distance >= min_distance
+            ind = np.argmax(far_enough) if far_enough.any() else np.argmax(distance)
+            locations[player] = (x[ind], y[ind])
+            distance = np.minimum(distance, distance_on_torus(x, y, x[ind], y[ind]))
         return locations
 
 
@@ -130,6 +309,44 @@ class MapView:
     def __setitem__(self, inds: Any, value: Any):
         self.array[inds] = value
 
+    def window(self, x: float, y: float, dx: int, dy: int) -> np.ndarray:
+        """
+        The ``(2 * dy + 1, 2 * dx + 1)`` window of the map centred on (x, y), which
+        wraps around the edges of the map. If the window does not cross an edge, it
+        is a view into the map and no data is copied.
+        """
+        ix = int(x)
+        iy = int(y)
+        ny, nx = self.array.shape
+        if (dx <= ix < nx - dx) and (dy <= iy < ny - dy):
+            return self.array[iy - dy : iy + dy + 1, ix - dx : ix + dx + 1]
+        rows = np.arange(iy - dy, iy + dy + 1)
+        cols = np.arange(ix - dx, ix + dx + 1)
+        return self.array.take(rows, axis=0, mode="wrap").take(
+            cols, axis=1, mode="wrap"
+        )
+
+    def window_indices(
+        self, x: np.ndarray, y: np.ndarray, dx: int, dy: int
+    ) -> np.ndarray:
+        """
+        The flat indices of the cells in the windows centred on all the given
+        positions, with shape ``(len(x), 2 * dy + 1, 2 * dx + 1)``.
+        """
+        ix = np.atleast_1d(np.asarray(x)).astype(int)
+        iy = np.atleast_1d(np.asarray(y)).astype(int)
+        ny, nx = self.array.shape
+        rows = (iy[:, None] + np.arange(-dy, dy + 1)) % ny
+        cols = (ix[:, None] + np.arange(-dx, dx + 1)) % nx
+        return rows[:, :, None] * nx + cols[:, None, :]
+
+    def windows(self, x: np.ndarray, y: np.ndarray, dx: int, dy: int) -> np.ndarray:
+        """
+        The windows of the map centred on all the given positions, stacked in an
+        array of shape ``(len(x), 2 * dy + 1, 2 * dx + 1)``.
+        """
+        return self.array.flat[self.window_indices(x=x, y=y, dx=dx, dy=dy)]
+
     def view(self, x: float, y: float, dx: int, dy: int) -> List[np.ndarray]:
         slices = self.view_slices(x, y, dx, dy)
         return [self.array[s[0], s[1]] for s in slices]
@@ -178,3 +395,54 @@ class MapView:
         elif ymax >= ny:
             slices.append((slice(0, ymax - ny), slice(xmin, xmax)))
         return slices
+
+
+class BaseLocations:
+    """
+    The set of the pixels occupied by bases, with the number of occupied pixels
+    within ``radius`` of every base. The counts are only updated when a pixel
+    becomes occupied or free, so that reading them every time step is cheap.
+    """
+
+    def __init__(self, nx: int, ny: int, radius: int):
+        self.nx = nx
+        self.ny = ny
+        self.radius = radius
+        self.occupied = set()
+        self.pixels = {}
+        self.counts = {}
+
+    def add(self, uid: str, x: float, y: float):
+        ix, iy = int(x), int(y)
+        if (ix, iy) not in self.occupied:
+            self.occupied.add((ix, iy))
+            self.update_counts(ix, iy, 1)
+        self.pixels[uid] = (ix, iy)
+        self.counts[uid] = self.within(ix, iy, self.occupied).sum()
+
+    def remove(self, uid: str):
+        # The pixel is freed even if another base sits on the same pixel
+        ix, iy = self.pixels.pop(uid)
+        del self.counts[uid]
+        if (ix, iy) in self.occupied:
+            self.occupied.remove((ix, iy))
+            self.update_counts(ix, iy, -1)
+
+    def within(self, ix: int, iy: int, pixels: Iterable) -> np.ndarray:
+        # Whether the pixels are inside the periodic window around (ix, iy)
+        size = np.array([self.nx, self.ny])
+        d = (np.array(list(pixels), dtype=int).reshape(-1, 2) - (ix, iy)) % size
+        return (np.minimum(d, size - d) <= self.radius).all(axis=1)
+
+    def update_counts(self, ix: int, iy: int, change: int):
+        inside = self.within(ix, iy, self.pixels.values())
+        for uid, near in zip(list(self.pixels), inside):
+            if near:
+                self.counts[uid] += change
+
+    def count(self, uid: str) -> int:
+        """
+        The number of pixels occupied by bases around the base ``uid``, including
+        its own.
+        """
+        return self.counts[uid]
@@ -6,7 +6,7 @@ from typing import Any
 import pyglet
 
 from . import config
-from .tools import text_to_image
+from .tools import text_to_label
 
 
 class Graphics:
@@ -23,15 +23,14 @@ class Graphics:
 
         self.background = self.engine.game_map.background_image.get_texture()
         self.main_batch = pyglet.graphics.Batch()
-        self.time_label = pyglet.sprite.Sprite(
-            img=text_to_image(
-                "Time left:", width=100, height=24, scale=False, font=config.medium_font
-            ),
-            x=(config.nx * config.scaling) + 20,
-            y=(config.ny * config.scaling) - 30,
-            batch=self.main_batch,
+        x = (config.nx * config.scaling) + 20
+        y = (config.ny * config.scaling) - 6
+        self.time_label = text_to_label(
+            "Time left:", x=x, y=y, batch=self.main_batch, font=config.medium_font
+        )
+        self.time_left = text_to_label(
+            "", x=x + 60, y=y, batch=self.main_batch, font=config.medium_font
         )
-        self.time_left = None
         self.exit_message = None
 
         # redpixel = pyglet.image.load(ir.files("supremacy") / "resources" / "marker.png")
@@ -45,12 +44,14 @@ class Graphics:
         # )
 
         self.scoreboard_labels = []
+        self.profile_labels = []
 
         @self.window.event
         def on_draw():
-            self.window.clear()
-            self.background.blit(0, 0)
-            self.main_batch.draw()
+            with self.engine.profiler.phase("draw"):
+                self.window.clear()
+                self.background.blit(0, 0)
+                self.main_batch.draw()
 
         @self.window.event
         def on_key_release(symbol, modifiers):
@@ -58,17 +59,27 @@ class Graphics:
                 self.engine.paused = not self.engine.paused
 
     def update_scoreboard(self, t: float):
-        if self.time_left is not None:
-            self.time_left.delete()
         t_str = str(datetime.timedelta(seconds=int(t)))[2:]
-        self.time_left = pyglet.sprite.Sprite(
-            img=text_to_image(
-                t_str, width=100, height=24, scale=False, font=config.medium_font
-            ),
-            x=self.time_label.x + 60,
-            y=self.time_label.y,
-            batch=self.main_batch,
-        )
+        if self.time_left.text != t_str:
+            self.time_left.text = t_str
+        self.update_profile_overlay()
+
+    def update_profile_overlay(self):
+        # The timings of the recent time steps, at the bottom of the scoreboard
+        lines = self.engine.profiler.overlay_text()
+        for i in range(len(self.profile_labels), len(lines)):
+            self.profile_labels.append(
+                text_to_label(
+                    "",
+                    x=(config.nx * config.scaling) + 4,
+                    y=14 * (len(lines) - i) + 4,
+                    batch=self.main_batch,
+                    font=config.small_font,
+                )
+            )
+        for label, line in zip(self.profile_labels, lines):
+            if label.text != line:
+                label.text = line
 
     def show_exit_message(self):
         self.exit_message = pyglet.text.Label(
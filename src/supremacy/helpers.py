@@ -2,6 +2,8 @@
 import numpy as np
 from typing import Callable
 
+from .game_map import MapView
+
 
 def control_vehicles(
     info: dict, game_map: np.ndarray, tank: Callable, ship: Callable, jet: Callable
@@ -81,3 +83,32 @@ class BuildQueue:
                     self.inds[base.uid] += 1
                 del self.wants_to_build[base.uid]
                 return build
+
+
+def map_window(
+    game_map: np.ndarray, x: float, y: float, dx: int, dy: int
+) -> np.ndarray:
+    """
+    Get the part of the map around a position, taking into account that the map
+    wraps around its edges.
+
+    Parameters
+    ----------
+    game_map : np.ndarray
+        A 2D numpy array containing the game map.
+    x : float
+        The x coordinate of the centre of the window.
+    y : float
+        The y coordinate of the centre of the window.
+    dx : int
+        The half width of the window.
+    dy : int
+        The half height of the window.
+
+    Returns
+    -------
+    window :
+        A ``(2 * dy + 1, 2 * dx + 1)`` array. When the window does not cross an edge
+        of the map, this is a view into ``game_map`` and must not be modified.
+    """
+    return MapView(game_map).window(x=x, y=y, dx=dx, dy=dy)
@@ -0,0 +1,252 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+import math
+from collections import OrderedDict
+from functools import cached_property
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse import csgraph
+
+from .game_map import periodic_label
+
+# The terrain each kind of vehicle can move on
+TERRAIN = {"tank": 1, "ship": 0}
+# The 8 moves between neighbouring cells of the coarse grid, as (dy, dx)
+STEPS = np.array([(0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (-1, 1)])
+STEP_COSTS = np.hypot(STEPS[:, 0], STEPS[:, 1])
+# When the way ahead is blocked, the heading is turned by these angles (in degrees)
+TURNS = (0, 20, -20, 40, -40, 60, -60, 80, -80)
+# The distances ahead (in pixels) where to look for the coast
+LOOKAHEAD = (0.5, 1.0, 1.5)
+
+
+class Navigation:
+    """
+    Precomputed structures to find paths for tanks and ships on the torus, shared
+    by all the players.
+
+    Paths are found on a coarse grid of ``cell_size`` x ``cell_size`` pixels, where
+    a cell is passable for a kind of vehicle if at least half of its pixels are of
+    the right terrain. The connected regions of land and water are labelled at the
+    resolution of the map the first time they are needed, so that the targets in
+    another region are ruled out without searching for a path. Only the map and the
+    passable cells are pickled: a worker process rebuilds the rest.
+    """
+
+    def __init__(
+        self,
+        game_map: np.ndarray,
+        cell_size: int = 8,
+        passable: Optional[Dict[str, np.ndarray]] = None,
+    ):
+        self.ny, self.nx = game_map.shape
+        self.terrain = game_map.astype(np.int8)
+        self.cell_size = cell_size
+        b = cell_size
+        self.shape = (-(-self.ny // b), -(-self.nx // b))
+        rows = np.arange(0, self.ny, b)
+        cols = np.arange(0, self.nx, b)
+        area = np.multiply.outer(
+            np.minimum(b, self.ny - rows), np.minimum(b, self.nx - cols)
+        )
+        iy, ix = np.indices(self.shape)
+        self.neighbours = np.stack(
+            [
+                (
+                    ((iy + dy) % self.shape[0]) * self.shape[1]
+                    + (ix + dx) % self.shape[1]
+                )
+                for dy, dx in STEPS
+            ]
+        ).reshape(len(STEPS), -1)
+        self.passable = {}
+        self.moves = {}
+        self.graphs = {}
+        for kind, terrain in TERRAIN.items():
+            if passable is None:
+                mask = game_map == terrain
+                count = np.add.reduceat(
+                    np.add.reduceat(mask, rows, axis=0), cols, axis=1
+                )
+                self.passable[kind] = ((2 * count) >= area).ravel()
+            else:
+                self.passable[kind] = passable[kind]
+            self.moves[kind] = self.make_moves(self.passable[kind])
+            self.graphs[kind] = self.make_graph(self.moves[kind])
+
+    def __reduce__(self) -> tuple:
+        return (Navigation, (self.terrain, self.cell_size, self.passable))
+
+    @cached_property
+    def labels(self) -> Dict[str, np.ndarray]:
+        labels = {}
+        for kind, terrain in TERRAIN.items():
+            array, n = periodic_label(self.terrain == terrain)
+            labels[kind] = array.astype(np.min_scalar_type(n))
+        return labels
+
+    def make_moves(self, passable: np.ndarray) -> np.ndarray:
+        """
+        Whether each of the 8 moves is allowed from every coarse cell: both cells
+        must be passable, and diagonal moves may not cut corners.
+        """
+        moves = passable & passable[self.neighbours]
+        steps = STEPS.tolist()
+        for step, (dy, dx) in enumerate(steps):
+            if dx and dy:
+                moves[step] &= moves[steps.index([0, dx])]
+                moves[step] &= moves[steps.index([dy, 0])]
+        return moves
+
+    def make_graph(self, moves: np.ndarray) -> sparse.csr_matrix:
+        step, source = np.nonzero(moves)
+        size = moves.shape[1]
+        return sparse.csr_matrix(
+            (STEP_COSTS[step], (source, self.neighbours[step, source])),
+            shape=(size, size),
+        )
+
+    def cell(self, x: float, y: float) -> int:
+        """
+        The index of the coarse cell containing the position (x, y).
+        """
+        ix = int(x) % self.nx
+        iy = int(y) % self.ny
+        return (iy // self.cell_size) * self.shape[1] + ix // self.cell_size
+
+    def region(self, kind: str, x: float, y: float) -> int:
+        """
+        The label of the connected region of land (for tanks) or water (for ships)
+        at the position (x, y). The label is 0 if the terrain is of the other kind.
+        """
+        return int(self.labels[kind][int(y) % self.ny, int(x) % self.nx])
+
+    def field(self, kind: str, target: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The distance (in coarse cells) from every coarse cell to the ``target``
+        cell, and the step to take from each cell to get closer to it (-1 if the
+        target is reached or cannot be reached).
+        """
+        passable = self.passable[kind]
+        # A target on the coast may lie in a cell that is not passable: start from
+        # the passable cells around it instead
+        sources = np.append(target, self.neighbours[:, target])
+        sources = sources[passable[sources]]
+        if len(sources) == 0:
+            distance = np.full(passable.size, np.inf, dtype=np.float32)
+        else:
+            # The graph is symmetric, so the distances from the target are also the
+            # distances to the target
+            distance = csgraph.dijkstra(
+                self.graphs[kind], indices=sources, min_only=True
+            ).astype(np.float32)
+        candidates = np.where(
+            self.moves[kind],
+            distance[self.neighbours] + STEP_COSTS[:, None].astype(np.float32),
+            np.float32(np.inf),
+        )
+        steps = np.argmin(candidates, axis=0).astype(np.int8)
+        steps[(distance == 0) | ~np.isfinite(candidates.min(axis=0))] = -1
+        return distance, steps
+
+    def steer(self, kind: str, x: float, y: float, heading: float) -> float:
+        """
+        Turn the heading away from the coast if the way ahead is blocked, since the
+        coarse cells on a path can contain some pixels of the other terrain.
+        """
+        terrain = TERRAIN[kind]
+        for turn in TURNS:
+            angle = math.radians(heading + turn)
+            dx = math.cos(angle)
+            dy = math.sin(angle)
+            if all(
+                self.terrain[int(y + d * dy) % self.ny, int(x + d * dx) % self.nx]
+                == terrain
+                for d in LOOKAHEAD
+            ):
+                return (heading + turn) % 360
+        return heading
+
+    def straight_heading(self, x: float, y: float, tx: float, ty: float) -> float:
+        """
+        The heading (in degrees) of the shortest straight line from (x, y) to
+        (tx, ty), potentially through the periodic boundaries.
+        """
+        dx = (tx - x + self.nx / 2) % self.nx - self.nx / 2
+        dy = (ty - y + self.ny / 2) % self.ny - self.ny / 2
+        return math.degrees(math.atan2(dy, dx)) % 360
+
+
+class Navigator:
+    """
+    Finds the paths of the vehicles of one player. For every requested target, the
+    distance to the target of all the coarse cells (with Dijkstra's algorithm), and
+    the direction to take from each cell, are computed once and kept in a cache of
+    the ``cache_size`` targets most recently used by the player. Every player has
+    its own cache, so that a player never pays for the targets of the others.
+    """
+
+    def __init__(self, navigation: Navigation, cache_size: int = 16):
+        self.navigation = navigation
+        self.cache_size = cache_size
+        self._fields = OrderedDict()
+
+    def field(self, kind: str, target: int) -> Tuple[np.ndarray, np.ndarray]:
+        key = (kind, target)
+        if key in self._fields:
+            self._fields.move_to_end(key)
+            return self._fields[key]
+        self._fields[key] = self.navigation.field(kind, target)
+        if len(self._fields) > self.cache_size:
+            self._fields.popitem(last=False)
+        return self._fields[key]
+
+    def heading(
+        self, kind: str, x: float, y: float, tx: float, ty: float
+    ) -> Optional[float]:
+        """
+        The heading (in degrees) that a vehicle of the given kind at (x, y) should
+        take to reach (tx, ty), going around the obstacles. Jets fly straight to the
+        target. Returns ``None`` if the target cannot be reached.
+        """
+        nav = self.navigation
+        if kind not in TERRAIN:
+            return nav.straight_heading(x, y, tx, ty)
+        # A target in another region of land or water cannot be reached, there is
+        # no need to find the distances to it
+        source = nav.region(kind, x, y)
+        region = nav.region(kind, tx, ty)
+        if source and region and (source != region):
+            return None
+        start = nav.cell(x, y)
+        target = nav.cell(tx, ty)
+        distance, steps = self.field(kind, target)
+        if nav.passable[kind][start]:
+            step = steps[start]
+            if distance[start] == np.inf:
+                return None
+        else:
+            # Vehicles on the coast can be in a cell that is not passable: head for
+            # the neighbour closest to the target
+            costs = distance[nav.neighbours[:, start]] + STEP_COSTS
+            step = int(np.argmin(costs))
+            if not np.isfinite(costs[step]):
+                return None
+            if distance[nav.neighbours[step, start]] == 0:
+                step = -1
+        if step < 0:
+            return nav.steer(kind, x, y, nav.straight_heading(x, y, tx, ty))
+        b = nav.cell_size
+        cy, cx = divmod(int(nav.neighbours[step, start]), nav.shape[1])
+        heading = nav.straight_heading(
+            x, y, min((cx + 0.5) * b, nav.nx - 0.5), min((cy + 0.5) * b, nav.ny - 0.5)
+        )
+        return nav.steer(kind, x, y, heading)
+
+    def reachable(self, kind: str, x: float, y: float, tx: float, ty: float) -> bool:
+        """
+        Whether a vehicle of the given kind at (x, y) can reach (tx, ty).
+        """
+        return self.heading(kind, x, y, tx, ty) is not None
@@ -1,8 +1,11 @@
 # SPDX-License-Identifier: BSD-3-Clause
 
+import os
+import time
+import traceback
 import uuid
 from itertools import chain
-from typing import Any, Iterator, Tuple
+from typing import Any, Iterator, List, Optional, Tuple
 
 import numpy as np
 from PIL import Image
@@ -10,8 +13,14 @@ import pyglet
 
 from . import config
 from .base import Base
-from .game_map import MapView
-from .tools import text_to_raw_image
+from .game_map import BaseLocations, MapView, read_only
+from .navigation import Navigation, Navigator
+from .tools import text_to_label
+from .units import UnitStore
+from .watchdog import Watchdog
+from .workers import BASE_COMMANDS, SHIP_COMMANDS, VEHICLE_COMMANDS
+
+FOG_BLOCK_SIZE = 8
 
 
 class Player:
@@ -24,18 +33,28 @@ class Player:
         batch: Any,
         game_map: np.ndarray,
         score: int,
-        base_locations: np.ndarray,
+        base_locations: BaseLocations,
+        units: UnitStore,
+        navigation: Navigation,
         high_contrast: bool = False,
+        tick_budget: Optional[float] = None,
+        match_budget: Optional[float] = None,
     ):
         self.ai = ai
         self.ai.team = team
+        self.watchdog = Watchdog(tick_budget=tick_budget, match_budget=match_budget)
         self.hq = location
         self.number = number
         self.team = team
         self.batch = batch
         self.base_locations = base_locations
+        self.units = units
+        self.navigator = Navigator(navigation)
         self.original_map_array = game_map
         self.game_map = MapView(np.full_like(game_map, -1))
+        self.bot_map = read_only(self.game_map.array)
+        self.init_fog_blocks()
+        self.map_delta = np.zeros(0, dtype=int)
         self.dead = False
         self.bases = {}
         self.tanks = {}
@@ -50,13 +69,59 @@ class Player:
         self.animate_cross = 0
         self.score_position = self.number
         self.avatar = None
-        self.make_avatar_base_image()
+        self.name_label = None
+        self.score_label = None
+
+    def init_fog_blocks(self):
+        # Count how many cells are known in each block of the map, to quickly skip
+        # the windows that are already fully revealed
+        ny, nx = self.game_map.array.shape
+        b = FOG_BLOCK_SIZE
+        rows = np.minimum(b, ny - np.arange(0, ny, b))
+        cols = np.minimum(b, nx - np.arange(0, nx, b))
+        self.block_size = np.multiply.outer(rows, cols)
+        self.block_known = np.zeros_like(self.block_size)
+        self.block_full = np.zeros(self.block_size.shape, dtype=bool)
 
-    def update_player_map(self, x: float, y: float):
+    def update_player_map(self, x: np.ndarray, y: np.ndarray):
+        """
+        Reveal the map around all the given positions at once. The flat indices of
+        the cells revealed during the current time step are stored in ``map_delta``.
+        """
+        ix = np.atleast_1d(np.asarray(x)).astype(int)
+        iy = np.atleast_1d(np.asarray(y)).astype(int)
+        ny, nx = self.game_map.array.shape
         r = config.view_radius
-        slices = self.game_map.view_slices(x=x, y=y, dx=r, dy=r)
-        for s in slices:
-            self.game_map.array[s[0], s[1]] = self.original_map_array[s[0], s[1]]
+        b = FOG_BLOCK_SIZE
+
+        # Skip windows lying entirely in fully known blocks. Sampling the window
+        # every block size is enough to see all the blocks it overlaps, as long as
+        # it does not wrap around the edges of the map.
+        samples = np.unique(np.append(np.arange(-r, r + 1, b), r))
+        brows = np.clip((iy[:, None] + samples) // b, 0, self.block_full.shape[0] - 1)
+        bcols = np.clip((ix[:, None] + samples) // b, 0, self.block_full.shape[1] - 1)
+        interior = (iy >= r) & (iy + r < ny) & (ix >= r) & (ix + r < nx)
+        known = interior & self.block_full[brows[:, :, None], bcols[:, None, :]].all(
+            axis=(1, 2)
+        )
+        centres = np.unique(iy[~known] * nx + ix[~known])
+        if len(centres) == 0:
+            return
+
+        window = self.game_map.window_indices(
+            x=centres % nx, y=centres // nx, dx=r, dy=r
+        )
+        cells = np.unique(window[self.game_map.array.flat[window] == -1])
+        if len(cells) == 0:
+            return
+        self.game_map.array.flat[cells] = self.original_map_array.flat[cells]
+        self.map_delta = np.concatenate([self.map_delta, cells])
+
+        blocks = (cells // nx // b) * self.block_known.shape[1] + (cells % nx) // b
+        self.block_known += np.bincount(
+            blocks, minlength=self.block_known.size
+        ).reshape(self.block_known.shape)
+        self.block_full = self.block_known == self.block_size
 
     def build_base(self, x: float, y: float):
         uid = uuid.uuid4().hex
@@ -68,26 +133,53 @@ class Player:
             batch=self.batch,
             owner=self,
             uid=uid,
+            units=self.units,
             high_contrast=self.high_contrast,
         )
-        self.base_locations[int(y), int(x)] = 1
+        self.base_locations.add(uid, x=x, y=y)
         return uid
 
     def init_dt(self):
         self.transformed_ships.clear()
+        self.map_delta = np.zeros(0, dtype=int)
 
     def execute_ai(self, t: float, dt: float, info: dict, safe: bool = False):
-        if safe:
-            try:
-                self.ai.run(t=t, dt=dt, info=info, game_map=self.game_map.array)
-            except:
-                pass
-        else:
-            self.ai.run(t=t, dt=dt, info=info, game_map=self.game_map.array)
+        if not self.watchdog.allow():
+            return
+        start = time.thread_time()
+        try:
+            self.ai.run(t=t, dt=dt, info=info, game_map=self.bot_map)
+        except Exception:
+            if not safe:
+                raise
+            self.watchdog.record_error(traceback.format_exc())
+        finally:
+            self.watchdog.record(t=t, used=time.thread_time() - start)
+
+    def execute_commands(self, commands: List[tuple]):
+        """
+        Apply the commands recorded by an AI running in a worker process, in the
+        order they were issued. Commands for units that no longer exist are ignored.
+        """
+        for name, uid, *args in commands:
+            if uid in self.bases:
+                obj, allowed = self.bases[uid], BASE_COMMANDS
+            elif uid in self.ships:
+                obj, allowed = self.ships[uid], SHIP_COMMANDS
+            elif uid in self.tanks:
+                obj, allowed = self.tanks[uid], VEHICLE_COMMANDS
+            elif uid in self.jets:
+                obj, allowed = self.jets[uid], VEHICLE_COMMANDS
+            else:
+                continue
+            if name in allowed:
+                getattr(obj, name)(*args)
 
     def collect_transformed_ships(self):
         for uid in self.transformed_ships:
-            del self.ships[uid]
+            if uid in self.ships:
+                self.ships[uid].delete()
+                del self.ships[uid]
 
     @property
     def children(self) -> Iterator:
@@ -124,6 +216,7 @@ class Player:
         else:
             for base in self.bases.values():
                 if uid in base.mines:
+                    base.mines[uid].delete()
                     del base.mines[uid]
                     base.make_avatar()
 
@@ -134,52 +227,42 @@ class Player:
     def economy(self) -> int:
         return int(sum([base.crystal for base in self.bases.values()]))
 
-    def make_avatar_base_image(self):
-        self.avatar_base_image = Image.new("RGBA", (100, 24), (0, 0, 0, 0))
-        key = "skull" if self.dead else "player"
-        self.avatar_base_image.paste(config.images[f"{key}_{self.number}"], (0, 0))
-        self.avatar_base_image.paste(
-            text_to_raw_image(
-                self.team[:10], width=70, height=24, font=config.medium_font
-            ),
-            (30, 0),
-        )
-
     def update_score(self, score: int):
         self.score_this_round += score
         self.global_score += score
 
     def make_avatar(self, ind):
         self.score_position = ind
-        img = Image.new("RGBA", (200, 24), (0, 0, 0, 0))
-        img.paste(self.avatar_base_image, (0, 0))
-        img.paste(
-            text_to_raw_image(
-                f"  {'  ' if self.score_position < 9 else ''}"
-                f"{self.score_position + 1}.   "
-                f"{self.global_score}[{self.score_this_round}]",
-                width=100,
-                height=24,
-                font=config.medium_font,
-            ),
-            (100, 0),
-        )
-
-        imd = pyglet.image.ImageData(
-            width=img.width,
-            height=img.height,
-            fmt="RGBA",
-            data=img.tobytes(),
-            pitch=-img.width * 4,
-        )
-        if self.avatar is not None:
-            self.avatar.delete()
-        self.avatar = pyglet.sprite.Sprite(
-            img=imd,
-            x=(config.nx * config.scaling) + 4,
-            y=(config.ny * config.scaling) - 100 - 35 * self.score_position,
-            batch=self.batch,
+        if config.headless:
+            return
+        img = config.images[f"{'skull' if self.dead else 'base'}_{self.number}"]
+        score = (
+            f"  {'  ' if self.score_position < 9 else ''}"
+            f"{self.score_position + 1}.   "
+            f"{self.global_score}[{self.score_this_round}]"
         )
+        x = (config.nx * config.scaling) + 4
+        y = (config.ny * config.scaling) - 76 - 35 * self.score_position
+        if self.avatar is None:
+            self.avatar = pyglet.sprite.Sprite(img=img, batch=self.batch)
+            self.name_label = text_to_label(
+                self.team[:10], x=x, y=y, batch=self.batch, font=config.medium_font
+            )
+            self.score_label = text_to_label(
+                score, x=x, y=y, batch=self.batch, font=config.medium_font
+            )
+        if self.avatar.image is not img:
+            self.avatar.image = img
+        if self.score_label.text != score:
+            self.score_label.text = score
+        self.name_label.position = (x + 30, y, 0)
+        self.score_label.position = (x + 100, y, 0)
+        # The icon is anchored at its centre, with its top left corner at (x, y)
+        icon = (x + img.anchor_x, y - img.height + img.anchor_y)
+        if self.animate_cross > 0:
+            self.cross_x[0], self.cross_y[0] = icon
+        else:
+            self.avatar.position = (*icon, 0)
 
     def rip(self):
         for v in self.vehicles:
@@ -188,15 +271,16 @@ class Player:
         self.ships.clear()
         self.jets.clear()
         self.dead = True
-        self.make_avatar_base_image()
 
-    def dump_map(self):
+    def dump_map(self, output_dir: str = "."):
         im = Image.fromarray(
             np.flipud((self.game_map.array.astype(np.uint8) + 1) * 127)
         )
-        im.save(f"{self.team}_map.png")
+        im.save(os.path.join(output_dir, f"{self.team}_map.png"))
 
     def init_cross_animation(self):
+        if self.avatar is None:
+            return
         self.animate_cross = 8
         self.cross_x = np.linspace(
             self.avatar.x, (config.nx / 2) * config.scaling, self.animate_cross
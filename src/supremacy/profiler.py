@@ -0,0 +1,243 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+import contextlib
+import csv
+import json
+import os
+import time
+from typing import List
+
+import numpy as np
+
+from .units import KINDS, UnitStore
+
+PHASES = (
+    "explosions",
+    "income",
+    "scoreboard",
+    "bots",
+    "collect",
+    "move",
+    "fog",
+    "fight",
+    "deaths",
+    "replay",
+    "draw",
+)
+COUNTS = KINDS + ("fight_pairs",)
+
+
+class _Timer:
+    def __init__(self, wall: np.ndarray, cpu: np.ndarray, column: int, clock=None):
+        self.wall = wall
+        self.cpu = cpu
+        self.column = column
+        self.clock = clock or time.process_time
+        self.row = 0
+
+    def __enter__(self):
+        self.start_wall = time.perf_counter()
+        self.start_cpu = self.clock()
+
+    def __exit__(self, *exc):
+        self.wall[self.row, self.column] += time.perf_counter() - self.start_wall
+        self.cpu[self.row, self.column] += self.clock() - self.start_cpu
+
+
+class TickProfiler:
+    """
+    Records the wall and CPU time spent in each phase of a time step, and by the
+    AI of each player, along with the number of units of each kind and the number
+    of pairs of units close enough to fight. The last ``size`` time steps are kept
+    in ring buffers, and running totals are kept for the whole match.
+    """
+
+    enabled = True
+
+    def __init__(self, teams: List[str], size: int = 1000):
+        self.teams = list(teams)
+        self.size = size
+        self.ticks = np.full(size, -1)
+        self.wall = np.zeros((size, len(PHASES)))
+        self.cpu = np.zeros((size, len(PHASES)))
+        self.bot_wall = np.zeros((size, len(self.teams)))
+        self.bot_cpu = np.zeros((size, len(self.teams)))
+        self.counts = np.zeros((size, len(COUNTS)), dtype=int)
+        self.total_wall = np.zeros(len(PHASES))
+        self.total_cpu = np.zeros(len(PHASES))
+        self.total_bot_wall = np.zeros(len(self.teams))
+        self.total_bot_cpu = np.zeros(len(self.teams))
+        self.nticks = 0
+        self.row = 0
+        self._phases = {
+            name: _Timer(self.wall, self.cpu, i) for i, name in enumerate(PHASES)
+        }
+        # Only the thread running the AI counts for the CPU time of a bot
+        self._bots = {
+            team: _Timer(self.bot_wall, self.bot_cpu, i, clock=time.thread_time)
+            for i, team in enumerate(self.teams)
+        }
+
+    def start_tick(self, tick: int):
+        if self.nticks > 0:
+            self.total_wall += self.wall[self.row]
+            self.total_cpu += self.cpu[self.row]
+            self.total_bot_wall += self.bot_wall[self.row]
+            self.total_bot_cpu += self.bot_cpu[self.row]
+        self.row = self.nticks % self.size
+        self.nticks += 1
+        self.ticks[self.row] = tick
+        for array in (self.wall, self.cpu, self.bot_wall, self.bot_cpu, self.counts):
+            array[self.row] = 0
+        for timer in self._phases.values():
+            timer.row = self.row
+        for timer in self._bots.values():
+            timer.row = self.row
+
+    def phase(self, name: str) -> _Timer:
+        """
+        Context manager timing a phase of the current time step.
+        """
+        return self._phases[name]
+
+    def bot(self, team: str) -> _Timer:
+        """
+        Context manager timing the AI of a player running in this process.
+        """
+        return self._bots[team]
+
+    def record_bot(self, team: str, wall: float, cpu: float):
+        i = self.teams.index(team)
+        self.bot_wall[self.row, i] += wall
+        self.bot_cpu[self.row, i] += cpu
+
+    def count(self, name: str, value: int):
+        self.counts[self.row, COUNTS.index(name)] = value
+
+    def count_units(self, units: UnitStore):
+        kinds = units.kind[units.active()]
+        self.counts[self.row, : len(KINDS)] = np.bincount(kinds, minlength=len(KINDS))
+
+    def recent(self) -> np.ndarray:
+        """
+        The rows of the ring buffers for the time steps recorded so far, oldest
+        first.
+        """
+        n = min(self.nticks, self.size)
+        return (np.arange(n) + self.nticks - n) % self.size
+
+    def overlay_text(self) -> List[str]:
+        """
+        One line per phase and per player with the mean wall time in ms over the
+        recent time steps, for the live overlay.
+        """
+        rows = self.recent()[:-1]
+        if len(rows) == 0:
+            return []
+        wall = self.wall[rows].mean(axis=0) * 1000
+        bots = self.bot_wall[rows].mean(axis=0) * 1000
+        counts = self.counts[rows[-1]]
+        lines = [f"{name}: {ms:.2f} ms" for name, ms in zip(PHASES, wall)]
+        lines += [f"{team[:10]}: {ms:.2f} ms" for team, ms in zip(self.teams, bots)]
+        lines.append(f"units: {counts[: len(KINDS)].sum()}  pairs: {counts[-1]}")
+        return lines
+
+    def summary(self) -> dict:
+        """
+        The total and mean wall and CPU times of the phases and of the AIs over the
+        whole match, and their maximum over the recent time steps.
+        """
+        # The running totals do not include the current time step yet
+        totals = {
+            "phases": (
+                self.total_wall + self.wall[self.row],
+                self.total_cpu + self.cpu[self.row],
+                self.wall,
+                PHASES,
+            ),
+            "bots": (
+                self.total_bot_wall + self.bot_wall[self.row],
+                self.total_bot_cpu + self.bot_cpu[self.row],
+                self.bot_wall,
+                self.teams,
+            ),
+        }
+        nticks = max(self.nticks, 1)
+        summary = {"ticks": self.nticks}
+        for key, (wall, cpu, recent, names) in totals.items():
+            summary[key] = {
+                name: {
+                    "wall": float(wall[i]),
+                    "cpu": float(cpu[i]),
+                    "mean_wall_ms": float(wall[i] / nticks * 1000),
+                    "max_wall_ms": float(recent[:, i].max() * 1000),
+                }
+                for i, name in enumerate(names)
+            }
+        return summary
+
+    def dump(self, output_dir: str = "."):
+        """
+        Write the summary of the match and the recent time steps to
+        ``profile.json``, and the recent time steps to ``profile.csv``.
+        """
+        columns = (
+            ["tick"]
+            + [f"{name}_wall" for name in PHASES]
+            + [f"{name}_cpu" for name in PHASES]
+            + [f"bot_{team}_wall" for team in self.teams]
+            + [f"bot_{team}_cpu" for team in self.teams]
+            + list(COUNTS)
+        )
+        table = [
+            [int(self.ticks[row])]
+            + self.wall[row].tolist()
+            + self.cpu[row].tolist()
+            + self.bot_wall[row].tolist()
+            + self.bot_cpu[row].tolist()
+            + self.counts[row].tolist()
+            for row in self.recent()
+        ]
+        summary = self.summary()
+        summary["recent"] = {
+            name: [line[i] for line in table] for i, name in enumerate(columns)
+        }
+        with open(os.path.join(output_dir, "profile.json"), "w") as f:
+            json.dump(summary, f)
+        with open(os.path.join(output_dir, "profile.csv"), "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            writer.writerows(table)
+
+
+class NullProfiler:
+    """
+    Stands in for the ``TickProfiler`` when profiling is off, and does nothing.
+    """
+
+    enabled = False
+    _timer = contextlib.nullcontext()
+
+    def start_tick(self, tick: int):
+        pass
+
+    def phase(self, name: str) -> contextlib.nullcontext:
+        return self._timer
+
+    def bot(self, team: str) -> contextlib.nullcontext:
+        return self._timer
+
+    def record_bot(self, team: str, wall: float, cpu: float):
+        pass
+
+    def count(self, name: str, value: int):
+        pass
+
+    def count_units(self, units: UnitStore):
+        pass
+
+    def overlay_text(self) -> List[str]:
+        return []
+
+    def dump(self, output_dir: str = "."):
+        pass
@@ -0,0 +1,490 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+import datetime
+import json
+import zipfile
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pyglet
+
+from . import config
+from .fight import Explosion
+from .game_map import GameMap, find_shoreline, make_background_image
+from .units import KIND_IDS, KINDS, UnitStore
+
+REPLAY_VERSION = 1
+
+# The state of every unit, stored as one array per field
+STATE_FIELDS = {
+    "serial": np.int32,
+    "kind": np.int8,
+    "team": np.int16,
+    "x": np.float32,
+    "y": np.float32,
+    "heading": np.float32,
+    "health": np.int16,
+}
+
+# The changes between two ticks
+EVENT_FIELDS = {
+    "born": dict(STATE_FIELDS),
+    "died": {"serial": np.int32, "killed": bool, "x": np.float32, "y": np.float32},
+    "moved": {
+        "serial": np.int32,
+        "x": np.float32,
+        "y": np.float32,
+        "heading": np.float32,
+    },
+    "hit": {"serial": np.int32, "health": np.int16},
+}
+
+
+def _empty(fields: dict) -> Dict[str, np.ndarray]:
+    return {name: np.zeros(0, dtype=dtype) for name, dtype in fields.items()}
+
+
+class ReplayRecorder:
+    """
+    Records a match in a compact binary file, to be watched later without running
+    the bots.
+
+    The file is a zip archive of numpy arrays. It contains the map and, for every
+    tick, the units that were built, destroyed, moved or damaged, as columnar
+    arrays. The ticks are grouped in chunks that start with a keyframe holding the
+    full state of all the units, so that a reader can seek to any tick without
+    replaying the match from the start. Chunks are written as soon as they are
+    complete, and the archive is closed after each of them: if the match is
+    interrupted, even by killing the process, the ticks up to the last chunk can
+    still be watched.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        game_map: GameMap,
+        teams: List[str],
+        colors: List[Tuple[float, ...]],
+        dt: float,
+        seed: Optional[int] = None,
+        high_contrast: bool = False,
+        keyframe_interval: int = 150,
+    ):
+        self.path = path
+        self.keyframe_interval = keyframe_interval
+        self.meta = {
+            "version": REPLAY_VERSION,
+            "nx": int(game_map.nx),
+            "ny": int(game_map.ny),
+            "dt": dt,
+            "seed": seed,
+            "teams": list(teams),
+            "colors": [[float(c) for c in rgb] for rgb in colors],
+            "high_contrast": high_contrast,
+            "keyframe_interval": keyframe_interval,
+        }
+        with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as file:
+            file.writestr("meta.json", json.dumps(self.meta))
+            self.write(file, "map", game_map.array)
+            self.write(file, "relief", game_map.relief)
+        self.tick = 0
+        self.state = _empty(STATE_FIELDS)
+        self.slots = np.zeros(0, dtype=int)
+        self.serial_counter = 0
+        self.start_chunk()
+
+    def write(self, file: zipfile.ZipFile, name: str, array: np.ndarray):
+        with file.open(f"{name}.npy", "w", force_zip64=True) as f:
+            np.lib.format.write_array(f, np.asarray(array), allow_pickle=False)
+
+    def start_chunk(self):
+        self.keyframe = None
+        self.events = {group: [] for group in EVENT_FIELDS}
+        self.scores = []
+
+    def record(self, units: UnitStore, scores: List[int]):
+        """
+        Record the state of the units at the end of a tick, along with the scores
+        of the players.
+        """
+        slots = units.active()
+        slots = slots[np.argsort(units.serial[slots])]
+        state = {
+            name: getattr(units, name)[slots].astype(dtype)
+            for name, dtype in STATE_FIELDS.items()
+        }
+        previous = self.state
+        died = ~np.isin(previous["serial"], state["serial"], assume_unique=True)
+        born = ~np.isin(state["serial"], previous["serial"], assume_unique=True)
+
+        # Most units destroyed during this tick still hold their last state in their
+        # slot, as it has not been given to a new unit yet. This includes the units
+        # that were built and destroyed during the same tick.
+        dead_slots = self.slots[died]
+        intact = units.serial[dead_slots] == previous["serial"][died]
+        dead_slots = dead_slots[intact]
+        if units.serial_counter - self.serial_counter > born.sum():
+            new = units.serial[: units.size] >= self.serial_counter
+            dead_slots = np.concatenate(
+                [dead_slots, np.flatnonzero(new & ~units.alive[: units.size])]
+            )
+        events = {
+            "born": {name: values[born] for name, values in state.items()},
+            "died": {
+                "serial": np.concatenate(
+                    [previous["serial"][died][~intact], units.serial[dead_slots]]
+                ),
+                "killed": np.concatenate(
+                    [
+                        np.zeros((~intact).sum(), dtype=bool),
+                        units.health[dead_slots] <= 0,
+                    ]
+                ),
+                "x": np.concatenate(
+                    [previous["x"][died][~intact], units.x[dead_slots]]
+                ),
+                "y": np.concatenate(
+                    [previous["y"][died][~intact], units.y[dead_slots]]
+                ),
+            },
+        }
+        # The units present at both ticks are in the same order, sorted by serial
+        old = {name: values[~died] for name, values in previous.items()}
+        new = {name: values[~born] for name, values in state.items()}
+        moved = (
+            (old["x"] != new["x"])
+            | (old["y"] != new["y"])
+            | (old["heading"] != new["heading"])
+        )
+        hit = old["health"] != new["health"]
+        events["moved"] = {name: new[name][moved] for name in EVENT_FIELDS["moved"]}
+        events["hit"] = {name: new[name][hit] for name in EVENT_FIELDS["hit"]}
+        for group, fields in EVENT_FIELDS.items():
+            self.events[group].append(
+                {
+                    name: events[group][name].astype(dtype)
+                    for name, dtype in fields.items()
+                }
+            )
+        self.scores.append(scores)
+        if self.keyframe is None:
+            self.keyframe = state
+
+        self.state = state
+        self.slots = slots
+        self.serial_counter = units.serial_counter
+        self.tick += 1
+        if self.tick % self.keyframe_interval == 0:
+            self.write_chunk()
+
+    def write_chunk(self):
+        if self.keyframe is None:
+            return
+        prefix = f"chunk_{(self.tick - 1) // self.keyframe_interval:05d}"
+        with zipfile.ZipFile(self.path, "a", compression=zipfile.ZIP_DEFLATED) as file:
+            for name, values in self.keyframe.items():
+                self.write(file, f"{prefix}/key_{name}", values)
+            for group, fields in EVENT_FIELDS.items():
+                events = self.events[group]
+                counts = [len(e["serial"]) for e in events]
+                self.write(file, f"{prefix}/{group}_offsets", np.cumsum([0] + counts))
+                for name, dtype in fields.items():
+                    self.write(
+                        file,
+                        f"{prefix}/{group}_{name}",
+                        np.concatenate([e[name] for e in events]).astype(dtype),
+                    )
+            self.write(
+                file, f"{prefix}/scores", np.array(self.scores, dtype=np.int32)
+            )
+        self.start_chunk()
+
+    def close(self):
+        """
+        Write the ticks recorded since the last chunk.
+        """
+        self.write_chunk()
+
+
+class ReplayReader:
+    """
+    Reads a replay file written by a :class:`ReplayRecorder`. The chunks are loaded
+    on demand, and seeking to a tick starts from the keyframe of its chunk.
+    """
+
+    def __init__(self, path: str):
+        self.file = zipfile.ZipFile(path, "r")
+        self.meta = json.loads(self.file.read("meta.json"))
+        if self.meta["version"] != REPLAY_VERSION:
+            raise ValueError(
+                f"Unsupported replay version {self.meta['version']} in {path}"
+            )
+        self.nx = self.meta["nx"]
+        self.ny = self.meta["ny"]
+        self.dt = self.meta["dt"]
+        self.teams = self.meta["teams"]
+        self.colors = [tuple(rgb) for rgb in self.meta["colors"]]
+        self.keyframe_interval = self.meta["keyframe_interval"]
+        # The number of ticks is given by the chunks that were written
+        chunks = sorted(
+            name for name in self.file.namelist() if name.endswith("/scores.npy")
+        )
+        self.ticks = 0
+        if chunks:
+            last = len(self.read(chunks[-1][: -len(".npy")]))
+            self.ticks = (len(chunks) - 1) * self.keyframe_interval + last
+        self.game_map = self.read("map")
+        self.relief = self.read("relief")
+        self.tick = None
+        self.state = None
+        self._chunks = {}
+
+    def read(self, name: str) -> np.ndarray:
+        with self.file.open(f"{name}.npy") as f:
+            return np.lib.format.read_array(f, allow_pickle=False)
+
+    def chunk(self, index: int) -> Dict[str, np.ndarray]:
+        if index not in self._chunks:
+            # Only keep the chunks around the current position in memory
+            if len(self._chunks) > 1:
+                del self._chunks[next(iter(self._chunks))]
+            prefix = f"chunk_{index:05d}/"
+            self._chunks[index] = {
+                name[len(prefix) : -len(".npy")]: self.read(name[: -len(".npy")])
+                for name in self.file.namelist()
+                if name.startswith(prefix)
+            }
+        return self._chunks[index]
+
+    def events(self, tick: int, group: str) -> Dict[str, np.ndarray]:
+        """
+        The units that were built (``"born"``), destroyed (``"died"``), moved
+        (``"moved"``) or damaged (``"hit"``) during a tick.
+        """
+        chunk = self.chunk(tick // self.keyframe_interval)
+        i = tick % self.keyframe_interval
+        start, end = chunk[f"{group}_offsets"][i : i + 2]
+        return {
+            name: chunk[f"{group}_{name}"][start:end] for name in EVENT_FIELDS[group]
+        }
+
+    def explosions(self, tick: int) -> Tuple[np.ndarray, np.ndarray]:
+        died = self.events(tick, "died")
+        return died["x"][died["killed"]], died["y"][died["killed"]]
+
+    def scores(self, tick: int) -> np.ndarray:
+        chunk = self.chunk(tick // self.keyframe_interval)
+        return chunk["scores"][tick % self.keyframe_interval]
+
+    def seek(self, tick: int) -> Dict[str, np.ndarray]:
+        """
+        Return the state of all the units at the end of the given tick, as arrays
+        sorted by serial number.
+        """
+        tick = min(max(tick, 0), self.ticks - 1)
+        start = tick - (tick % self.keyframe_interval)
+        if (self.tick is None) or (self.tick > tick) or (self.tick < start):
+            chunk = self.chunk(tick // self.keyframe_interval)
+            self.state = {name: chunk[f"key_{name}"].copy() for name in STATE_FIELDS}
+            self.tick = start
+        while self.tick < tick:
+            self.step()
+        return self.state
+
+    def step(self):
+        self.tick += 1
+        state = self.state
+        died = self.events(self.tick, "died")
+        if len(died["serial"]) > 0:
+            keep = ~np.isin(state["serial"], died["serial"], assume_unique=True)
+            state = {name: values[keep] for name, values in state.items()}
+        born = self.events(self.tick, "born")
+        if len(born["serial"]) > 0:
+            state = {
+                name: np.concatenate([values, born[name]])
+                for name, values in state.items()
+            }
+        for group in ("moved", "hit"):
+            changes = self.events(self.tick, group)
+            ind = np.searchsorted(state["serial"], changes["serial"])
+            for name, values in changes.items():
+                state[name][ind] = values
+        self.state = state
+
+
+class ReplayViewer:
+    """
+    Plays back a replay in a window, with no bots loaded.
+
+    Controls: space pauses, the left and right arrows jump 10 seconds back and
+    forward, and the up and down arrows double and halve the playback speed.
+    """
+
+    def __init__(
+        self,
+        reader: ReplayReader,
+        speed: float = 1.0,
+        start: float = 0,
+        fullscreen: bool = False,
+    ):
+        self.reader = reader
+        self.speed = speed
+        self.position = start / reader.dt
+        self.paused = False
+        self.tick = None
+        self.sprites = {}
+        self.base_labels = {}
+        self.explosions = []
+
+        config.nx = reader.nx
+        config.ny = reader.ny
+        config.setup(colors=reader.colors, fullscreen=fullscreen)
+        self.window = pyglet.window.Window(
+            int((config.nx * config.scaling) + config.scoreboard_width),
+            int(config.ny * config.scaling),
+            caption="Supremacy replay",
+            fullscreen=fullscreen,
+            resizable=not fullscreen,
+        )
+        self.background = make_background_image(
+            array=reader.game_map,
+            shoreline=find_shoreline(reader.game_map),
+            relief=reader.relief,
+            high_contrast=reader.meta["high_contrast"],
+        ).get_texture()
+        self.batch = pyglet.graphics.Batch()
+        x = (config.nx * config.scaling) + 20
+        y = (config.ny * config.scaling) - 30
+        self.time_label = pyglet.text.Label(
+            "", x=x, y=y, color=(255, 255, 255, 255), batch=self.batch
+        )
+        self.score_labels = [
+            pyglet.text.Label(
+                "",
+                x=x,
+                y=y,
+                color=tuple(int(round(c * 255)) for c in rgb[:3]) + (255,),
+                batch=self.batch,
+            )
+            for rgb in config.colors
+        ]
+
+        @self.window.event
+        def on_draw():
+            self.window.clear()
+            self.background.blit(0, 0)
+            self.batch.draw()
+
+        @self.window.event
+        def on_key_release(symbol, modifiers):
+            key = pyglet.window.key
+            if symbol == key.SPACE:
+                self.paused = not self.paused
+            elif symbol == key.RIGHT:
+                self.position += 10 / self.reader.dt
+            elif symbol == key.LEFT:
+                self.position = max(self.position - 10 / self.reader.dt, 0)
+            elif symbol == key.UP:
+                self.speed *= 2
+            elif symbol == key.DOWN:
+                self.speed /= 2
+
+    def run(self):
+        pyglet.clock.schedule_interval(self.update, 1 / config.fps)
+        pyglet.app.run()
+
+    def update(self, dt: float):
+        for explosion in self.explosions:
+            explosion.update()
+        self.explosions = [e for e in self.explosions if e.animate >= 0]
+        if not self.paused:
+            self.position += self.speed
+        self.position = min(self.position, self.reader.ticks - 1)
+        tick = int(self.position)
+        if tick == self.tick:
+            return
+        # Only show the explosions of the last few ticks when playing fast
+        if (self.tick is not None) and (tick > self.tick):
+            for t in range(max(self.tick + 1, tick - 4), tick + 1):
+                for x, y in zip(*self.reader.explosions(t)):
+                    self.explosions.append(Explosion(x, y, self.batch))
+        self.tick = tick
+        self.show(self.reader.seek(tick))
+        self.update_scoreboard(tick)
+
+    def show(self, state: Dict[str, np.ndarray]):
+        is_mine = state["kind"] == KIND_IDS["mine"]
+        mines = {}
+        for team, x, y in zip(
+            state["team"][is_mine], state["x"][is_mine], state["y"][is_mine]
+        ):
+            mines[(team, x, y)] = mines.get((team, x, y), 0) + 1
+
+        alive = set()
+        for serial, kind, team, x, y, heading, health in zip(
+            *(state[name][~is_mine] for name in STATE_FIELDS)
+        ):
+            alive.add(serial)
+            kind = KINDS[kind]
+            if kind == "base":
+                key = f"base_{team}"
+            else:
+                key = f"{kind}_{team}_{health}"
+            sx = x * config.scaling
+            sy = y * config.scaling
+            if serial not in self.sprites:
+                sprite = pyglet.sprite.Sprite(
+                    img=config.images[key], x=sx, y=sy, batch=self.batch
+                )
+                self.sprites[serial] = [sprite, key]
+            sprite, current = self.sprites[serial]
+            if current != key:
+                sprite.image = config.images[key]
+                self.sprites[serial][1] = key
+            if kind == "base":
+                self.show_base_labels(
+                    serial, sx, sy, health, mines.get((team, x, y), 0)
+                )
+            else:
+                sprite.update(x=sx, y=sy, rotation=-heading)
+
+        for serial in set(self.sprites) - alive:
+            self.sprites.pop(serial)[0].delete()
+            for label in self.base_labels.pop(serial, ()):
+                label.delete()
+
+    def show_base_labels(self, serial: int, x: float, y: float, health: int, n: int):
+        images = (config.images[f"health_{health}"], config.images[f"mines_{n}"])
+        if serial not in self.base_labels:
+            self.base_labels[serial] = [
+                pyglet.sprite.Sprite(
+                    img=images[0],
+                    x=x - (6 * config.scaling),
+                    y=y + (18 * config.scaling),
+                    batch=self.batch,
+                ),
+                pyglet.sprite.Sprite(
+                    img=images[1],
+                    x=x + (18 * config.scaling),
+                    y=y + (18 * config.scaling),
+                    batch=self.batch,
+                ),
+            ]
+        for label, image in zip(self.base_labels[serial], images):
+            if label.image is not image:
+                label.image = image
+
+    def update_scoreboard(self, tick: int):
+        t = datetime.timedelta(seconds=int(tick * self.reader.dt))
+        self.time_label.text = f"Time: {str(t)[2:]}   x{self.speed:g}"
+        scores = self.reader.scores(tick)
+        for i, n in enumerate(np.argsort(-scores, kind="stable")):
+            label = self.score_labels[n]
+            label.text = f"{i + 1}. {self.reader.teams[n][:10]}: {scores[n]}"
+            label.y = self.time_label.y - 35 * (i + 1)
+
+
+def play(path: str, speed: float = 1.0, start: float = 0, fullscreen: bool = False):
+    ReplayViewer(
+        ReplayReader(path), speed=speed, start=start, fullscreen=fullscreen
+    ).run()
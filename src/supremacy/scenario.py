@@ -0,0 +1,217 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+import contextlib
+import io
+import sys
+import uuid
+from functools import partial
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from . import config
+from .base import Base, Mine
+from .game_map import GameMap, MapView
+from .player import Player
+from .vehicles import Jet, Ship, Tank
+
+VEHICLES = {"tanks": Tank, "ships": Ship, "jets": Jet}
+# The terrain each kind of vehicle can stand on
+TERRAIN = {"tanks": 1, "ships": 0}
+
+
+class IdleAi:
+    def __init__(self, name: str):
+        self.team = name
+
+    def run(self, t: float, dt: float, info: dict, game_map: np.ndarray):
+        pass
+
+
+class IdleBot:
+    """
+    A bot whose AI does nothing, for the players of a scenario that are only there
+    to be shot at or to fill the map.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def get(self, key: str) -> None:
+        return None
+
+    def factory(self) -> Callable:
+        return partial(IdleAi, name=self.name)
+
+
+def build(spec: dict, quiet: bool = True, **kwargs) -> Any:
+    """
+    Create a game in the state described by ``spec``, without playing it. The
+    units are created directly: nothing is paid for, and in headless mode (the
+    default) no sprites are made. The game does not start, advance it with
+    ``engine.update(engine.dt)`` or ``engine.run()``.
+
+    The spec is a dict with the keys:
+
+    - ``seed``: the seed of the map and of the random numbers (default 1)
+    - ``nx``, ``ny``: the size of the map (default: from the number of players)
+    - ``players``: a dict of players, by name. Each player is a dict with the
+      optional keys:
+
+      - ``bot``: the bot playing (default: an ``IdleBot`` that does nothing)
+      - ``bases``: a list of dicts with ``x``, ``y`` and optionally ``mines``
+        (default 1), ``crystal`` (default 0) and ``health``. Without bases, the
+        player gets the usual starting base.
+      - ``tanks``, ``ships``, ``jets``: lists of dicts with ``x``, ``y`` and
+        optionally ``heading`` (default 0), ``health``, ``stopped`` (default
+        False) and ``base`` (the index of the base that built it, default 0).
+
+    Other keyword arguments are passed on to the ``Engine``. The messages printed
+    while setting up the game are hidden if ``quiet`` is True.
+    """
+    from .engine import Engine
+
+    bots = {
+        name: player.get("bot") or IdleBot(name)
+        for name, player in spec["players"].items()
+    }
+    options = {
+        "headless": True,
+        "seed": spec.get("seed", 1),
+        "test": True,
+        "time_limit": 1e9,
+        **kwargs,
+        "map_size": map_size(spec),
+        "scenario": spec,
+        "autostart": False,
+    }
+    with contextlib.redirect_stdout(io.StringIO() if quiet else sys.stdout):
+        return Engine(bots, **options)
+
+
+def map_size(spec: dict) -> Optional[Tuple[int, int]]:
+    if ("nx" in spec) or ("ny" in spec):
+        return (spec["nx"], spec["ny"])
+    return None
+
+
+def terrain(spec: dict) -> np.ndarray:
+    """
+    The map of the game that ``build(spec)`` creates (1 is land and 0 is water),
+    to choose where to place the units of the spec. Only the seed, the size of the
+    map and the number of players are used.
+    """
+    config.initialize(
+        players={name: {} for name in spec["players"]},
+        headless=True,
+        map_size=map_size(spec),
+    )
+    return GameMap(nx=config.nx, ny=config.ny, seed=spec.get("seed", 1)).array
+
+
+def populate(players: Dict[str, Player], spec: dict):
+    """
+    Replace the starting bases of the players that have bases in the spec, and add
+    the vehicles of the spec. The fog of war of those players is reset, and only
+    lifted around the units of the spec.
+    """
+    for name, player_spec in spec["players"].items():
+        player = players[name]
+        if player_spec.get("bases"):
+            for uid in list(player.bases):
+                player.base_locations.remove(uid)
+                player.remove_base(uid)
+            reset_fog(player)
+            for base_spec in player_spec["bases"]:
+                add_base(player, **base_spec)
+        bases = list(player.bases.values())
+        for key, vehicle in VEHICLES.items():
+            for vehicle_spec in player_spec.get(key, []):
+                add_vehicle(player, vehicle, bases=bases, **vehicle_spec)
+        vehicles = list(player.vehicles)
+        if vehicles:
+            player.update_player_map(
+                x=np.array([v.x for v in vehicles]), y=np.array([v.y for v in vehicles])
+            )
+
+
+def reset_fog(player: Player):
+    player.game_map.array[...] = -1
+    player.map_delta = np.zeros(0, dtype=int)
+    player.init_fog_blocks()
+
+
+def add_base(
+    player: Player,
+    x: float,
+    y: float,
+    mines: int = 1,
+    crystal: float = 0,
+    health: Optional[int] = None,
+) -> Base:
+    r = config.view_radius
+    window = MapView(player.original_map_array).window(x=x, y=y, dx=r, dy=r)
+    if not ((window == 0).any() and (window == 1).any()):
+        raise ValueError(
+            f"Cannot place a base of player {player.team} at ({x}, {y}): it must be "
+            "on the coast."
+        )
+    uid = player.build_base(x=x, y=y)
+    base = player.bases[uid]
+    for _ in range(mines - 1):
+        muid = uuid.uuid4().hex
+        base.mines[muid] = Mine(
+            x=base.x,
+            y=base.y,
+            team=player.team,
+            number=player.number,
+            owner=base,
+            uid=muid,
+            units=player.units,
+        )
+    base.crystal = crystal
+    if health is not None:
+        base.health = health
+    base.make_avatar()
+    return base
+
+
+def add_vehicle(
+    player: Player,
+    vehicle: type,
+    bases: list,
+    x: float,
+    y: float,
+    heading: float = 0,
+    health: Optional[int] = None,
+    stopped: bool = False,
+    base: int = 0,
+):
+    key = f"{vehicle.__name__.lower()}s"
+    if key in TERRAIN:
+        ix, iy = int(x) % config.nx, int(y) % config.ny
+        if player.original_map_array[iy, ix] != TERRAIN[key]:
+            terrain = "land" if TERRAIN[key] == 1 else "water"
+            raise ValueError(
+                f"Cannot place a {key[:-1]} of player {player.team} at "
+                f"({x}, {y}): it must be on {terrain}."
+            )
+    uid = uuid.uuid4().hex
+    obj = vehicle(
+        x=x,
+        y=y,
+        team=player.team,
+        number=player.number,
+        heading=heading,
+        batch=player.batch,
+        owner=bases[base],
+        uid=uid,
+        units=player.units,
+    )
+    getattr(player, key)[uid] = obj
+    if health is not None:
+        obj.health = health
+        obj.make_avatar()
+    if stopped:
+        obj.stop()
+    return obj
@@ -1,13 +1,11 @@
 # SPDX-License-Identifier: BSD-3-Clause
 
-from typing import Any, Iterator, Tuple
+from typing import Any, Iterator, List, Sequence, Tuple, Union
 
 import numpy as np
-from PIL import Image, ImageDraw
 import pyglet
 
 from . import config
-from .config import scale_image
 
 
 def wrap_position(x: float, y: float) -> Tuple[float, float]:
@@ -47,6 +45,31 @@ def periodic_distances(
     return d, xl, yl
 
 
+def vector_to_heading(vec: Union[np.ndarray, Sequence[float]]) -> float:
+    """
+    The heading angle (in degrees) of the vector [vx, vy].
+    """
+    vec = np.asarray(vec) / np.linalg.norm(vec)
+    h = np.arccos(np.dot(vec, [1, 0])) * 180 / np.pi
+    if vec[1] < 0:
+        h = 360 - h
+    return h
+
+
+def vector_to(
+    x: float, y: float, tx: float, ty: float, shortest_path: bool = True
+) -> List[float]:
+    """
+    The vector from (x, y) to (tx, ty), potentially through the periodic boundaries
+    if ``shortest_path`` is True.
+    """
+    if not shortest_path:
+        return [tx - x, ty - y]
+    d, xl, yl = periodic_distances(x, y, tx, ty)
+    ind = np.argmin(d)
+    return [xl[ind] - (x + config.nx), yl[ind] - (y + config.ny)]
+
+
 class ReadOnly:
     def __init__(self, props: dict):
         self._data = props
@@ -66,28 +89,47 @@ class ReadOnly:
         return self._data.items()
 
 
-def text_to_raw_image(text, width, height, font=None):
+class InfoView:
+    """
+    Base class for the read-only views of game objects given to the players.
+    The fields listed in ``_keys`` are computed when they are accessed, and can be
+    read both as attributes and as mapping items.
+    """
+
+    __slots__ = ()
+    _keys = ()
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in self._keys:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def keys(self) -> Tuple[str, ...]:
+        return self._keys
+
+    def values(self) -> list:
+        return [getattr(self, key) for key in self._keys]
+
+    def items(self) -> list:
+        return [(key, getattr(self, key)) for key in self._keys]
+
+
+def text_to_label(text, x, y, batch, font=None):
+    """
+    A white pyglet label in the given font (the large font by default), with its
+    top left corner at (x, y). Its text can be changed without rendering any new
+    image.
+    """
     if font is None:
         font = config.large_font
-    img = Image.new("RGBA", (width, height), (0, 0, 0, 0))
-    d = ImageDraw.Draw(img)
-    d.text(
-        (0, 0),
+    return pyglet.text.Label(
         text,
-        fill=(255, 255, 255),
-        font=font,
-    )
-    return img
-
-
-def text_to_image(text, width, height, scale=True, font=None):
-    img = text_to_raw_image(text, width, height, font=font)
-    if scale:
-        img = scale_image(img, config.scaling)
-    return pyglet.image.ImageData(
-        width=img.width,
-        height=img.height,
-        fmt="RGBA",
-        data=img.tobytes(),
-        pitch=-img.width * 4,
+        font_name=font.getname()[0],
+        font_size=font.size * 72 / 96,
+        color=(255, 255, 255, 255),
+        x=x,
+        y=y,
+        anchor_x="left",
+        anchor_y="top",
+        batch=batch,
     )
@@ -0,0 +1,210 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+import contextlib
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .bots import Bot
+from .engine import Engine
+
+
+def make_groups(
+    names: List[str], group_size: Optional[int], rng: np.random.Generator
+) -> List[List[str]]:
+    """
+    Shuffle the players and split them into groups of at most ``group_size``
+    players, with sizes as equal as possible. Everyone plays in the same group if
+    ``group_size`` is ``None``.
+    """
+    names = list(names)
+    if (group_size is None) or (group_size >= len(names)):
+        return [names]
+    rng.shuffle(names)
+    ngroups = -(-len(names) // group_size)
+    return [[str(name) for name in g] for g in np.array_split(names, ngroups)]
+
+
+def play_match(
+    players: Dict[str, Bot], options: dict, output_dir: str
+) -> Dict[str, int]:
+    """
+    Play one headless match with all its outputs in ``output_dir``, and return the
+    points scored by each player during the match. The points are also written to
+    ``output_dir/result.txt`` once the match is over.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    if options.get("replay") is not None:
+        options = {**options, "replay": os.path.join(output_dir, options["replay"])}
+    with open(os.path.join(output_dir, "match.log"), "w") as log:
+        with contextlib.redirect_stdout(log):
+            engine = Engine(players, output_dir=output_dir, **options)
+            engine.finalize()
+    result = {name: p.score_this_round for name, p in engine.players.items()}
+    write_scores(os.path.join(output_dir, "result.txt"), result)
+    return result
+
+
+def read_scores(fname: str) -> Dict[str, int]:
+    scores = {}
+    if os.path.exists(fname):
+        with open(fname, "r") as f:
+            for line in f:
+                name, score = line.split(":")
+                scores[name] = int(score.strip())
+    return scores
+
+
+def write_scores(fname: str, scores: Dict[str, int]):
+    # Write to a temporary file and move it into place, so that the scores file is
+    # never seen half written
+    fd, tmp = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(fname)), prefix=".scores", suffix=".txt"
+    )
+    with os.fdopen(fd, "w") as f:
+        for name, score in scores.items():
+            f.write(f"{name}: {score}\n")
+    os.replace(tmp, fname)
+
+
+def plan_groups(
+    names: List[str],
+    rounds: int,
+    group_size: Optional[int],
+    seeds: Optional[List[int]],
+    fname: str,
+) -> List[List[List[str]]]:
+    """
+    The groups of players of every round. The groups are saved to ``fname`` when
+    they are first drawn, and read back when the tournament is restarted, so that
+    the rounds that were already started keep the same groups. Rounds that are
+    missing from the file are drawn and added to it.
+    """
+    plan = []
+    if os.path.exists(fname):
+        with open(fname, "r") as f:
+            plan = json.load(f)
+        for i, groups in enumerate(plan):
+            if sorted(sum(groups, [])) != sorted(names):
+                raise ValueError(
+                    f"The groups of round {i + 1} in {fname} do not match the "
+                    "players of the tournament. Use a new output directory."
+                )
+    rng = np.random.default_rng(seeds)
+    # Draw all the rounds, so that the groups follow from the seeds in the same
+    # way whether the tournament was restarted or not
+    drawn = [make_groups(names, group_size=group_size, rng=rng) for _ in range(rounds)]
+    if len(plan) < rounds:
+        plan += drawn[len(plan) :]
+        with open(fname, "w") as f:
+            json.dump(plan, f, indent=1)
+    return plan[:rounds]
+
+
+def run_tournament(
+    players: Dict[str, Bot],
+    options: dict,
+    rounds: int = 1,
+    seeds: Optional[List[int]] = None,
+    group_size: Optional[int] = None,
+    processes: Optional[int] = None,
+    output_dir: str = "tournament",
+) -> Dict[str, int]:
+    """
+    Play a number of rounds of headless matches in a pool of processes.
+
+    Every round, the players are split into groups that each play a match. Round
+    ``i`` uses the map seed ``seeds[i % len(seeds)]``, or a random map if no seeds
+    are given. The points scored in each match are added to the scores in
+    ``output_dir/scores.txt`` as soon as the match is over. The matches that
+    already have a result in their directory are not played again, so that an
+    interrupted tournament can be restarted where it stopped. A match that fails
+    is reported and left out, and is played again when the tournament is
+    restarted. The groups of every round are saved to ``output_dir/groups.json``,
+    so that a restarted tournament plays the same groups.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    fname = os.path.join(output_dir, "scores.txt")
+    scores = {name: 0 for name in players}
+    options = {
+        **options,
+        "headless": True,
+        "fullscreen": False,
+        "parallel": False,
+        "test": True,
+    }
+    plan = plan_groups(
+        list(players),
+        rounds=rounds,
+        group_size=group_size,
+        seeds=seeds,
+        fname=os.path.join(output_dir, "groups.json"),
+    )
+
+    matches = []
+    for i, groups in enumerate(plan):
+        seed = seeds[i % len(seeds)] if seeds else None
+        for j, group in enumerate(groups):
+            name = f"round_{i + 1:03d}"
+            if len(groups) > 1:
+                name += f"_group_{j + 1}"
+            matches.append(
+                (
+                    name,
+                    {n: players[n] for n in group},
+                    {**options, "seed": seed},
+                    os.path.join(output_dir, name),
+                )
+            )
+
+    todo = []
+    for match in matches:
+        result = read_scores(os.path.join(match[-1], "result.txt"))
+        if result and (sorted(result) != sorted(match[1])):
+            print(f"The result of {match[0]} is not for its players: replaying it")
+            result = {}
+        if result:
+            for name, score in result.items():
+                scores[name] += score
+        else:
+            todo.append(match)
+    write_scores(fname, scores)
+
+    print(f"Playing {len(todo)} of {len(matches)} matches in {output_dir}")
+    start = time.time()
+    failed = []
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context) as pool:
+        futures = {
+            pool.submit(play_match, group, opts, path): name
+            for name, group, opts, path in todo
+        }
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception:
+                print(f"{futures[future]} failed:\n{traceback.format_exc()}")
+                failed.append(futures[future])
+                continue
+            for name, score in result.items():
+                scores[name] += score
+            write_scores(fname, scores)
+            ranking = ", ".join(
+                f"{name}: {score}"
+                for name, score in sorted(result.items(), key=lambda x: -x[1])
+            )
+            print(f"{futures[future]} done [{ranking}]")
+
+    print(f"Tournament finished in {time.time() - start:.1f}s")
+    if failed:
+        print(f"{len(failed)} matches failed: {', '.join(sorted(failed))}")
+    for i, (name, score) in enumerate(sorted(scores.items(), key=lambda x: -x[1])):
+        print(f"{i + 1}. {name}: {score}")
+    return scores
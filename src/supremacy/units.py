@@ -0,0 +1,175 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+from typing import Any
+
+import numpy as np
+
+KINDS = ("base", "tank", "ship", "jet", "mine")
+KIND_IDS = {kind: i for i, kind in enumerate(KINDS)}
+COLUMNS = (
+    "x",
+    "y",
+    "heading",
+    "speed",
+    "health",
+    "attack",
+    "kind",
+    "team",
+    "alive",
+    "stopped",
+    "previous_x",
+    "previous_y",
+    "serial",
+)
+# The columns of the state of the units that can be seen by the players
+STATE = (
+    "x",
+    "y",
+    "heading",
+    "speed",
+    "health",
+    "attack",
+    "stopped",
+    "previous_x",
+    "previous_y",
+)
+
+
+class UnitStore:
+    """
+    Columnar storage for the state of all the units (bases, mines and vehicles) in
+    the game. Each unit owns a slot, i.e. an index into the arrays. The slots of
+    removed units are recycled when new units are added.
+    """
+
+    def __init__(self, capacity: int = 256):
+        self.size = 0
+        # Incremented every time a unit is added or removed
+        self.version = 0
+        self.serial_counter = 0
+        self.free_slots = []
+        self.objects = []
+        self.x = np.zeros(0)
+        self.y = np.zeros(0)
+        self.heading = np.zeros(0)
+        self.speed = np.zeros(0)
+        self.health = np.zeros(0, dtype=int)
+        self.attack = np.zeros(0, dtype=int)
+        self.kind = np.zeros(0, dtype=np.int8)
+        self.team = np.zeros(0, dtype=np.int16)
+        self.alive = np.zeros(0, dtype=bool)
+        self.stopped = np.zeros(0, dtype=bool)
+        self.previous_x = np.zeros(0)
+        self.previous_y = np.zeros(0)
+        self.serial = np.zeros(0, dtype=int)
+        self.resize(capacity)
+
+    @property
+    def capacity(self) -> int:
+        return len(self.alive)
+
+    def resize(self, capacity: int):
+        for name in COLUMNS:
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[: len(old)] = old
+            setattr(self, name, new)
+        self.objects += [None] * (capacity - len(self.objects))
+
+    def add(
+        self,
+        obj: Any,
+        kind: str,
+        team: int,
+        x: float,
+        y: float,
+        health: int,
+        attack: int,
+        speed: float = 0,
+        heading: float = 0,
+    ) -> int:
+        """
+        Add a unit to the store and return its slot.
+        """
+        if self.free_slots:
+            slot = self.free_slots.pop()
+        else:
+            if self.size == self.capacity:
+                self.resize(max(2 * self.capacity, 1))
+            slot = self.size
+            self.size += 1
+        self.objects[slot] = obj
+        self.x[slot] = x
+        self.y[slot] = y
+        self.heading[slot] = heading
+        self.speed[slot] = speed
+        self.health[slot] = health
+        self.attack[slot] = attack
+        self.kind[slot] = KIND_IDS[kind]
+        self.team[slot] = team
+        self.alive[slot] = True
+        self.stopped[slot] = False
+        self.previous_x[slot] = np.nan
+        self.previous_y[slot] = np.nan
+        self.serial[slot] = self.serial_counter
+        self.serial_counter += 1
+        self.version += 1
+        return slot
+
+    def detach(self, slot: int) -> "UnitStore":
+        """
+        Remove the unit in ``slot`` from the store. Its last state is returned in a
+        standalone single-slot store, so that objects which still refer to a dead
+        unit never read or write a slot that has been given to a new unit.
+        """
+        detached = UnitStore(capacity=1)
+        detached.add(
+            self.objects[slot],
+            kind=KINDS[self.kind[slot]],
+            team=self.team[slot],
+            x=self.x[slot],
+            y=self.y[slot],
+            health=self.health[slot],
+            attack=self.attack[slot],
+            speed=self.speed[slot],
+            heading=self.heading[slot],
+        )
+        detached.stopped[0] = self.stopped[slot]
+        detached.previous_x[0] = self.previous_x[slot]
+        detached.previous_y[0] = self.previous_y[slot]
+        detached.alive[0] = False
+        self.objects[slot] = None
+        self.alive[slot] = False
+        self.free_slots.append(slot)
+        self.version += 1
+        return detached
+
+    def freeze(self, slots: np.ndarray) -> "UnitStore":
+        """
+        Copy the state of the units in ``slots`` (in that order) to a standalone
+        store, which does not change when the units do. Only the columns read by the
+        views of the units are copied: the copy is not meant to be modified.
+        """
+        frozen = UnitStore.__new__(UnitStore)
+        frozen.size = len(slots)
+        for name in STATE:
+            setattr(frozen, name, getattr(self, name)[slots])
+        return frozen
+
+    def active(self) -> np.ndarray:
+        """
+        The slots of all the units currently in the game.
+        """
+        return np.flatnonzero(self.alive[: self.size])
+
+    def army_order(self, slots: np.ndarray) -> np.ndarray:
+        """
+        Sort the slots in the order of the players' armies: by team, then the bases,
+        tanks, ships, jets and mines, each in the order they were created. The mines
+        are grouped by base, like in ``Player.children``.
+        """
+        kind = self.kind[slots]
+        base = np.zeros(len(slots), dtype=int)
+        mines = np.flatnonzero(kind == KIND_IDS["mine"])
+        base[mines] = [self.serial[self.objects[s].owner.slot] for s in slots[mines]]
+        return slots[np.lexsort((self.serial[slots], base, kind, self.team[slots]))]
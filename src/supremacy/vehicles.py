@@ -1,12 +1,13 @@
 # SPDX-License-Identifier: BSD-3-Clause
 
-from typing import Any, Iterator, Sequence, Tuple, Union
+from typing import Any, Optional, Sequence, Union
 
 import numpy as np
 import pyglet
 
 from . import config
 from . import tools as tls
+from .units import UnitStore
 
 
 class Vehicle:
@@ -20,73 +21,114 @@ class Vehicle:
         batch: Any,
         owner: Any,
         uid: str,
+        units: UnitStore,
         heading: float = 0,
     ):
         self.team = team
         self.number = number
         self.owner = owner
         self.uid = uid
-        self.speed = config.speed[kind]
-        self.health = config.health[kind]
-        self.attack = config.attack[kind]
         self.kind = kind
         self.batch = batch
-        self.stopped = False
-        self.previous_position = None
 
         x, y = tls.wrap_position(x, y)
-        self.x = x
-        self.y = y
-        self.screen_x = x * config.scaling
-        self.screen_y = y * config.scaling
-        self._heading = heading
+        self._units = units
+        self.slot = units.add(
+            self,
+            kind=kind,
+            team=number,
+            x=x,
+            y=y,
+            health=config.health[kind],
+            attack=config.attack[kind],
+            speed=config.speed[kind],
+            heading=heading,
+        )
         self.avatar = None
         self.make_avatar()
-        self._as_info = None
+        self._proxy = None
+
+    @property
+    def x(self) -> float:
+        return float(self._units.x[self.slot])
+
+    @property
+    def y(self) -> float:
+        return float(self._units.y[self.slot])
+
+    @property
+    def screen_x(self) -> float:
+        return self.x * config.scaling
+
+    @property
+    def screen_y(self) -> float:
+        return self.y * config.scaling
+
+    @property
+    def speed(self) -> float:
+        return float(self._units.speed[self.slot])
+
+    @property
+    def attack(self) -> int:
+        return int(self._units.attack[self.slot])
+
+    @property
+    def health(self) -> int:
+        return int(self._units.health[self.slot])
+
+    @health.setter
+    def health(self, value: int):
+        self._units.health[self.slot] = value
+
+    @property
+    def stopped(self) -> bool:
+        return bool(self._units.stopped[self.slot])
+
+    @property
+    def previous_position(self) -> np.ndarray:
+        return np.array(
+            [self._units.previous_x[self.slot], self._units.previous_y[self.slot]]
+        )
 
     def make_avatar(self):
-        if self.health <= 0:
+        if config.headless or (self.health <= 0):
             return
+        img = config.images[f"{self.kind}_{self.number}_{self.health}"]
         if self.avatar is not None:
-            self.avatar.delete()
+            self.avatar.image = img
+            return
         self.avatar = pyglet.sprite.Sprite(
-            img=config.images[f"{self.kind}_{self.number}_{self.health}"],
-            x=self.screen_x,
-            y=self.screen_y,
-            batch=self.batch,
+            img=img, x=self.screen_x, y=self.screen_y, batch=self.batch
         )
-        self.avatar.rotation = -self._heading
+        self.avatar.rotation = -self.get_heading()
 
     def set_position(self, x: float, y: float):
-        self.x = x
-        self.y = y
-        self.screen_x = x * config.scaling
-        self.screen_y = y * config.scaling
-        self.avatar.x = self.screen_x
-        self.avatar.y = self.screen_y
+        self._units.x[self.slot] = x
+        self._units.y[self.slot] = y
+        self.move_avatar()
 
-    def reset_info(self):
-        self._as_info = None
+    def move_avatar(self):
+        if self.avatar is not None:
+            self.avatar.x = self.screen_x
+            self.avatar.y = self.screen_y
+
+    def snapshot(self, units: UnitStore, slot: int) -> "VehicleSnapshot":
+        """
+        The view of the vehicle given to the other players, which reads its state
+        from ``units``, a frozen copy of the store.
+        """
+        return VehicleSnapshot(self, units=units, slot=slot)
+
+    def proxy(self) -> "VehicleProxy":
+        """
+        The view of the vehicle given to its owner, which can also control it.
+        """
+        if self._proxy is None:
+            self._proxy = VehicleProxy(self)
+        return self._proxy
 
     def as_info(self) -> dict:
-        if self._as_info is None:
-            self._as_info = {
-                "team": self.team,
-                "number": self.number,
-                "uid": self.uid,
-                "speed": self.speed,
-                "health": self.health,
-                "attack": self.attack,
-                "x": self.x,
-                "y": self.y,
-                "heading": self.get_heading(),
-                "vector": self.get_vector(),
-                "position": self.get_position(),
-                "stopped": self.stopped,
-                "stuck": self.stuck(),
-                "kind": self.kind,
-            }
-        return self._as_info
+        return dict(VehicleInfo(self).items())
 
     def get_position(self) -> np.ndarray:
         """
@@ -99,15 +141,16 @@ class Vehicle:
         Return the current heading angle (in degrees) of the vehicle.
         East is 0, North is 90, West is 180, South is 270.
         """
-        return self._heading
+        return float(self._units.heading[self.slot])
 
     def set_heading(self, angle: float):
         """
         Set the heading angle (in degrees) of the vehicle.
         East is 0, North is 90, West is 180, South is 270.
         """
-        self._heading = angle
-        self.avatar.rotation = -angle
+        self._units.heading[self.slot] = angle
+        if self.avatar is not None:
+            self.avatar.rotation = -angle
 
     def get_vector(self) -> np.ndarray:
         """
@@ -120,11 +163,7 @@ class Vehicle:
         """
         Set the vehicle's heading according to the given vector [vx, vy].
         """
-        vec = np.asarray(vec) / np.linalg.norm(vec)
-        h = np.arccos(np.dot(vec, [1, 0])) * 180 / np.pi
-        if vec[1] < 0:
-            h = 360 - h
-        self.set_heading(h)
+        self.set_heading(tls.vector_to_heading(vec))
 
     def goto(self, x: float, y: float, shortest_path: bool = True):
         """
@@ -144,19 +183,56 @@ class Vehicle:
             Whether to take the shortest path, potentially through the periodic
             boundaries. Default is True.
         """
-        if not shortest_path:
-            self.set_vector([x - self.x, y - self.y])
-            return
-        d, xl, yl = tls.periodic_distances(self.x, self.y, x, y)
-        ind = np.argmin(d)
-        self.set_vector(
-            [xl[ind] - (self.x + config.nx), yl[ind] - (self.y + config.ny)]
-        )
+        self.set_vector(tls.vector_to(self.x, self.y, x, y, shortest_path))
 
-    def next_position(self, dt: float) -> Tuple[float, float]:
-        pos = self.get_position() + self.get_vector() * self.speed * dt
-        x, y = tls.wrap_position(*pos)
-        return x, y
+    def heading_to(self, x: float, y: float) -> Optional[float]:
+        """
+        Return the heading angle (in degrees) the vehicle should take to reach the
+        given position, going around the land for ships and around the water for
+        tanks. Jets fly in a straight line, potentially through the periodic
+        boundaries. Returns None if the position cannot be reached.
+
+        Parameters
+        ----------
+        x : float
+            The x-coordinate of the position to go to.
+        y : float
+            The y-coordinate of the position to go to.
+        """
+        return self.owner.owner.navigator.heading(self.kind, self.x, self.y, x, y)
+
+    def navigate(self, x: float, y: float) -> bool:
+        """
+        Set the vehicle's heading to follow the shortest path to the given position,
+        like ``heading_to``. Returns False, and leaves the heading unchanged, if the
+        position cannot be reached. The heading needs to be updated as the vehicle
+        moves, e.g. by calling ``navigate`` at every time step.
+
+        Parameters
+        ----------
+        x : float
+            The x-coordinate of the position to go to.
+        y : float
+            The y-coordinate of the position to go to.
+        """
+        heading = self.heading_to(x, y)
+        if heading is None:
+            return False
+        self.set_heading(heading)
+        return True
+
+    def can_reach(self, x: float, y: float) -> bool:
+        """
+        Return whether the vehicle can reach the given position.
+
+        Parameters
+        ----------
+        x : float
+            The x-coordinate of the position.
+        y : float
+            The y-coordinate of the position.
+        """
+        return self.heading_to(x, y) is not None
 
     def get_distance(self, x: float, y: float, shortest=True) -> float:
         """
@@ -181,91 +257,235 @@ class Vehicle:
             return tls.distance_on_torus(self.x, self.y, x, y)
 
     def delete(self):
-        self.avatar.delete()
+        if self.avatar is not None:
+            self.avatar.delete()
+            self.avatar = None
         # self.label.delete()
+        self._units = self._units.detach(self.slot)
+        self.slot = 0
 
     def stop(self):
-        self.stopped = True
+        self._units.stopped[self.slot] = True
 
     def start(self):
-        self.stopped = False
-
-    def move(self):
-        self.previous_position = self.get_position()
+        self._units.stopped[self.slot] = False
 
     def stuck(self):
-        return all(self.get_position() == self.previous_position)
+        return (self._units.x[self.slot] == self._units.previous_x[self.slot]) and (
+            self._units.y[self.slot] == self._units.previous_y[self.slot]
+        )
 
 
-class VehicleProxy:
+class VehicleInfo(tls.InfoView):
+    __slots__ = ("_vehicle",)
+    _keys = (
+        "team",
+        "number",
+        "uid",
+        "speed",
+        "health",
+        "attack",
+        "x",
+        "y",
+        "heading",
+        "vector",
+        "position",
+        "stopped",
+        "stuck",
+        "kind",
+    )
+
     def __init__(self, vehicle: Vehicle):
-        self._data = vehicle.as_info()
-        for key, item in self._data.items():
-            setattr(self, key, item)
-        self.owner = tls.ReadOnly(vehicle.owner.as_info())
-        self.set_heading = vehicle.set_heading
-        self.set_vector = vehicle.set_vector
-        self.goto = vehicle.goto
-        self.get_distance = vehicle.get_distance
-        if vehicle.kind == "ship":
-            self.convert_to_base = vehicle.convert_to_base
-        self.stop = vehicle.stop
-        self.start = vehicle.start
+        self._vehicle = vehicle
+
+    @property
+    def team(self) -> str:
+        return self._vehicle.team
+
+    @property
+    def number(self) -> int:
+        return self._vehicle.number
+
+    @property
+    def uid(self) -> str:
+        return self._vehicle.uid
+
+    @property
+    def speed(self) -> float:
+        return self._vehicle.speed
+
+    @property
+    def health(self) -> int:
+        return self._vehicle.health
+
+    @property
+    def attack(self) -> int:
+        return self._vehicle.attack
+
+    @property
+    def x(self) -> float:
+        return self._vehicle.x
+
+    @property
+    def y(self) -> float:
+        return self._vehicle.y
+
+    @property
+    def heading(self) -> float:
+        return self._vehicle.get_heading()
+
+    @property
+    def vector(self) -> np.ndarray:
+        return self._vehicle.get_vector()
+
+    @property
+    def position(self) -> np.ndarray:
+        return self._vehicle.get_position()
+
+    @property
+    def stopped(self) -> bool:
+        return self._vehicle.stopped
+
+    @property
+    def stuck(self) -> bool:
+        return self._vehicle.stuck()
+
+    @property
+    def kind(self) -> str:
+        return self._vehicle.kind
 
-    def __getitem__(self, key: str) -> Any:
-        return self._data[key]
 
-    def keys(self) -> Iterator:
-        return self._data.keys()
+class VehicleProxy(VehicleInfo):
+    __slots__ = ()
 
-    def values(self) -> Iterator:
-        return self._data.values()
+    @property
+    def owner(self) -> tls.ReadOnly:
+        return tls.ReadOnly(self._vehicle.owner.as_info())
 
-    def items(self) -> Iterator:
-        return self._data.items()
+    def set_heading(self, angle: float):
+        self._vehicle.set_heading(angle)
+
+    def set_vector(self, vec: Union[np.ndarray, Sequence[float]]):
+        self._vehicle.set_vector(vec)
+
+    def goto(self, x: float, y: float, shortest_path: bool = True):
+        self._vehicle.goto(x, y, shortest_path=shortest_path)
+
+    def get_distance(self, x: float, y: float, shortest=True) -> float:
+        return self._vehicle.get_distance(x, y, shortest=shortest)
+
+    def heading_to(self, x: float, y: float) -> Optional[float]:
+        return self._vehicle.heading_to(x, y)
+
+    def navigate(self, x: float, y: float) -> bool:
+        return self._vehicle.navigate(x, y)
+
+    def can_reach(self, x: float, y: float) -> bool:
+        return self._vehicle.can_reach(x, y)
+
+    def stop(self):
+        self._vehicle.stop()
+
+    def start(self):
+        self._vehicle.start()
+
+
+class ShipProxy(VehicleProxy):
+    __slots__ = ()
+
+    def convert_to_base(self):
+        return self._vehicle.convert_to_base()
+
+
+class VehicleSnapshot(VehicleInfo):
+    """
+    The view of a vehicle as it was when the store was frozen, so that keeping it
+    does not let the other players follow the vehicle once it is back under the
+    fog of war.
+    """
+
+    __slots__ = ("_units", "_slot")
+
+    def __init__(self, vehicle: Vehicle, units: UnitStore, slot: int):
+        self._vehicle = vehicle
+        self._units = units
+        self._slot = slot
+
+    @property
+    def speed(self) -> float:
+        return float(self._units.speed[self._slot])
+
+    @property
+    def health(self) -> int:
+        return int(self._units.health[self._slot])
+
+    @property
+    def attack(self) -> int:
+        return int(self._units.attack[self._slot])
+
+    @property
+    def x(self) -> float:
+        return float(self._units.x[self._slot])
+
+    @property
+    def y(self) -> float:
+        return float(self._units.y[self._slot])
+
+    @property
+    def heading(self) -> float:
+        return float(self._units.heading[self._slot])
+
+    @property
+    def vector(self) -> np.ndarray:
+        h = self.heading * np.pi / 180.0
+        return np.array([np.cos(h), np.sin(h)])
+
+    @property
+    def position(self) -> np.ndarray:
+        return np.array([self.x, self.y])
+
+    @property
+    def stopped(self) -> bool:
+        return bool(self._units.stopped[self._slot])
+
+    @property
+    def stuck(self) -> bool:
+        return (self._units.x[self._slot] == self._units.previous_x[self._slot]) and (
+            self._units.y[self._slot] == self._units.previous_y[self._slot]
+        )
 
 
 class Tank(Vehicle):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, kind="tank", **kwargs)
 
-    def move(self, x: float, y: float, map_value: int):
-        super().move()
-        if map_value == 1:
-            self.set_position(x, y)
-
 
 class Ship(Vehicle):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, kind="ship", **kwargs)
 
-    def move(self, x: float, y: float, map_value: int):
-        super().move()
-        if map_value == 0:
-            self.set_position(x, y)
+    def proxy(self) -> ShipProxy:
+        if self._proxy is None:
+            self._proxy = ShipProxy(self)
+        return self._proxy
 
     def convert_to_base(self):
         player = self.owner.owner
         x = int(self.x)
         y = int(self.y)
-        local_views = player.game_map.view(x=x, y=y, dx=1, dy=1)
-        if sum([view.sum() for view in local_views]) < 1:
-            print("No land found around ship, cannot build base on water!")
-            return
-        yy, xx = np.where(local_views[0] == 1)
+        yy, xx = np.where(player.game_map.window(x=x, y=y, dx=1, dy=1) == 1)
         if len(xx) == 0:
-            print("Error finding land around ship....")
+            print("No land found around ship, cannot build base on water!")
             return
-        uid = player.build_base(x=x + xx[0] - 1, y=y + yy[0] - 1)
+        ny, nx = player.game_map.array.shape
+        uid = player.build_base(x=(x + xx[0] - 1) % nx, y=(y + yy[0] - 1) % ny)
         player.transformed_ships.append(self.uid)
-        self.avatar.delete()
+        if self.avatar is not None:
+            self.avatar.delete()
+            self.avatar = None
         return uid
 
 
 class Jet(Vehicle):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, kind="jet", **kwargs)
-
-    def move(self, x: float, y: float, map_value: int):
-        super().move()
-        self.set_position(x, y)
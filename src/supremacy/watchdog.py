@@ -0,0 +1,70 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+from typing import Optional
+
+
+class Watchdog:
+    """
+    Keeps track of the CPU time used by the AI of a player.
+
+    A turn that takes longer than ``tick_budget`` is recorded as an overrun, and
+    the AI is throttled: it skips one turn for every budget it went over. Once the
+    total time exceeds ``match_budget``, the AI is not run anymore for the rest of
+    the match. Budgets of ``None`` mean no limit.
+    """
+
+    def __init__(
+        self, tick_budget: Optional[float] = None, match_budget: Optional[float] = None
+    ):
+        self.tick_budget = tick_budget
+        self.match_budget = match_budget
+        self.turns = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.skipped = 0
+        self.overruns = []
+        self.errors = 0
+        self.last_error = None
+        self._skip = 0
+
+    def allow(self, busy: bool = False) -> bool:
+        """
+        Whether the AI may play this turn. A ``busy`` AI is still running a previous
+        turn and always skips.
+        """
+        if (
+            busy
+            or (self._skip > 0)
+            or ((self.match_budget is not None) and (self.total > self.match_budget))
+        ):
+            self._skip = max(self._skip - 1, 0)
+            self.skipped += 1
+            return False
+        return True
+
+    def record(self, t: float, used: float):
+        self.turns += 1
+        self.total += used
+        self.max = max(self.max, used)
+        if (self.tick_budget is not None) and (used > self.tick_budget):
+            self.overruns.append((t, used))
+            self._skip = int(used // self.tick_budget)
+
+    def miss(self):
+        """
+        Count a turn that the AI did not finish in time as skipped. Its CPU time is
+        recorded when the AI is done with it.
+        """
+        self.skipped += 1
+
+    def record_error(self, error: str):
+        self.errors += 1
+        self.last_error = error
+
+    def summary(self) -> str:
+        mean = self.total / max(self.turns, 1)
+        return (
+            f"turns={self.turns} total={self.total:.2f}s mean={mean * 1000:.2f}ms "
+            f"max={self.max * 1000:.2f}ms overruns={len(self.overruns)} "
+            f"skipped={self.skipped} errors={self.errors}"
+        )
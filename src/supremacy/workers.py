@@ -0,0 +1,371 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+import multiprocessing
+import time
+import traceback
+import uuid
+from typing import Any, Callable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from . import config
+from .game_map import read_only
+from .navigation import Navigation, Navigator
+from .tools import (
+    ReadOnly,
+    distance_on_plane,
+    distance_on_torus,
+    vector_to,
+    vector_to_heading,
+)
+from .watchdog import Watchdog
+
+VEHICLE_COMMANDS = ("set_heading", "set_vector", "goto", "stop", "start")
+SHIP_COMMANDS = VEHICLE_COMMANDS + ("convert_to_base",)
+BASE_COMMANDS = ("build_mine", "build_tank", "build_ship", "build_jet")
+
+
+def serialize_info(info: dict) -> dict:
+    """
+    Convert the info given to an AI into plain dicts that can be sent to a worker
+    process. The player's own vehicles also carry the info about the base that
+    built them.
+    """
+    out = {}
+    for team, army in info.items():
+        out[team] = {}
+        for key, views in army.items():
+            out[team][key] = []
+            for view in views:
+                data = dict(view.items())
+                if hasattr(view, "owner"):
+                    data["owner"] = dict(view.owner.items())
+                out[team][key].append(data)
+    return out
+
+
+class RemoteVehicle(ReadOnly):
+    """
+    Stand-in for a vehicle proxy inside a worker process. Reading works like for a
+    normal proxy, while the control methods are recorded as commands that the
+    engine applies after the AI has run. The heading and the stopped state are
+    also changed locally, so that the AI sees them change like in the main
+    process.
+    """
+
+    def __init__(self, props: dict, commands: list, navigator: Navigator):
+        self.owner = ReadOnly(props.pop("owner"))
+        super().__init__(props)
+        self._commands = commands
+        self._navigator = navigator
+        if self.kind == "ship":
+            self.convert_to_base = self._convert_to_base
+
+    def set_heading(self, angle: float):
+        self._commands.append(("set_heading", self.uid, angle))
+        # The AI sees the new heading straight away, like with a normal proxy
+        h = angle * np.pi / 180.0
+        self.heading = self._data["heading"] = angle
+        self.vector = self._data["vector"] = np.array([np.cos(h), np.sin(h)])
+
+    def set_vector(self, vec: Union[np.ndarray, Sequence[float]]):
+        self.set_heading(vector_to_heading(vec))
+
+    def goto(self, x: float, y: float, shortest_path: bool = True):
+        self.set_vector(vector_to(self.x, self.y, x, y, shortest_path))
+
+    def stop(self):
+        self._commands.append(("stop", self.uid))
+        self.stopped = self._data["stopped"] = True
+
+    def start(self):
+        self._commands.append(("start", self.uid))
+        self.stopped = self._data["stopped"] = False
+
+    def _convert_to_base(self):
+        self._commands.append(("convert_to_base", self.uid))
+
+    def heading_to(self, x: float, y: float) -> Optional[float]:
+        return self._navigator.heading(self.kind, self.x, self.y, x, y)
+
+    def navigate(self, x: float, y: float) -> bool:
+        # The heading is found here, and applied like any other heading
+        heading = self.heading_to(x, y)
+        if heading is None:
+            return False
+        self.set_heading(heading)
+        return True
+
+    def can_reach(self, x: float, y: float) -> bool:
+        return self.heading_to(x, y) is not None
+
+    def get_distance(self, x: float, y: float, shortest=True) -> float:
+        if not shortest:
+            return distance_on_plane(self.x, self.y, x, y)
+        else:
+            return distance_on_torus(self.x, self.y, x, y)
+
+
+class RemoteBase(ReadOnly):
+    """
+    Stand-in for a base proxy inside a worker process. Builds are recorded as
+    commands, and the crystal and mines are updated locally so that the AI sees
+    the cost of what it has already ordered during this time step. Like in the main
+    process, building a vehicle returns the new vehicle: it is a stand-in with the
+    uid that the engine will give to the vehicle, so that it can already be given
+    commands. Until the next time step, it is at the position of the base.
+    """
+
+    def __init__(self, props: dict, commands: list, navigator: Navigator):
+        super().__init__(props)
+        self._commands = commands
+        self._navigator = navigator
+
+    def mine_cost(self) -> int:
+        return config.cost["mine"] * (2 ** (self.mines - 1))
+
+    def cost(self, kind: str) -> int:
+        if kind == "mine":
+            return self.mine_cost()
+        else:
+            return config.cost[kind]
+
+    def _order(self, kind: str, *args) -> bool:
+        cost = self.cost(kind)
+        if self.crystal < cost:
+            print(f"Not enough crystal to build {kind}")
+            return False
+        self.crystal -= cost
+        self._data["crystal"] = self.crystal
+        if kind == "mine":
+            self.mines += 1
+            self._data["mines"] = self.mines
+        self._commands.append((f"build_{kind}", self.uid) + args)
+        return True
+
+    def _build_vehicle(self, kind: str, heading: float) -> Optional[RemoteVehicle]:
+        uid = uuid.uuid4().hex
+        if not self._order(kind, heading, uid):
+            return
+        angle = np.radians(heading)
+        props = {
+            "team": self.team,
+            "number": self.number,
+            "uid": uid,
+            "speed": config.speed[kind],
+            "health": config.health[kind],
+            "attack": config.attack[kind],
+            "x": self.x,
+            "y": self.y,
+            "heading": heading,
+            "vector": np.array([np.cos(angle), np.sin(angle)]),
+            "position": np.array([self.x, self.y]),
+            "stopped": False,
+            "stuck": False,
+            "kind": kind,
+            "owner": dict(self._data),
+        }
+        return RemoteVehicle(props, self._commands, self._navigator)
+
+    def build_mine(self):
+        self._order("mine")
+
+    def build_tank(self, heading: float) -> Optional[RemoteVehicle]:
+        return self._build_vehicle("tank", heading)
+
+    def build_ship(self, heading: float) -> Optional[RemoteVehicle]:
+        return self._build_vehicle("ship", heading)
+
+    def build_jet(self, heading: float) -> Optional[RemoteVehicle]:
+        return self._build_vehicle("jet", heading)
+
+    def get_distance(self, x: float, y: float, shortest=True) -> float:
+        if not shortest:
+            return distance_on_plane(self.x, self.y, x, y)
+        else:
+            return distance_on_torus(self.x, self.y, x, y)
+
+
+def _make_info(snapshot: dict, team: str, commands: list, navigator: Navigator) -> dict:
+    info = {}
+    for name, army in snapshot.items():
+        info[name] = {}
+        for key, items in army.items():
+            if name != team:
+                info[name][key] = [ReadOnly(props) for props in items]
+            elif key == "bases":
+                info[name][key] = [
+                    RemoteBase(props, commands, navigator) for props in items
+                ]
+            else:
+                info[name][key] = [
+                    RemoteVehicle(props, commands, navigator) for props in items
+                ]
+    return info
+
+
+def _worker_main(
+    conn: Any,
+    ai_factory: Callable,
+    team: str,
+    game_map: np.ndarray,
+    navigation: Navigation,
+    nx: int,
+    ny: int,
+    safe: bool,
+    seed: int,
+):
+    config.nx = nx
+    config.ny = ny
+    config.headless = True
+    np.random.seed(seed)
+    ai = ai_factory()
+    ai.team = team
+    bot_map = read_only(game_map)
+    navigator = Navigator(navigation)
+    # Report that the AI is ready like the end of a turn with no commands
+    conn.send(("done", [], 0.0, 0.0, None))
+    while True:
+        message = conn.recv()
+        if message[0] == "close":
+            break
+        _, t, dt, snapshot, cells, values = message
+        game_map.flat[cells] = values
+        commands = []
+        error = None
+        info = _make_info(snapshot, team=team, commands=commands, navigator=navigator)
+        start = time.thread_time()
+        start_wall = time.perf_counter()
+        try:
+            ai.run(t=t, dt=dt, info=info, game_map=bot_map)
+        except Exception:
+            error = traceback.format_exc()
+        used = time.thread_time() - start
+        wall = time.perf_counter() - start_wall
+        if (error is not None) and (not safe):
+            conn.send(("error", error))
+        else:
+            conn.send(("done", commands, used, wall, error))
+    conn.close()
+
+
+class BotWorker:
+    """
+    Runs the AI of one player in its own process. Every time step, the worker
+    receives a snapshot of the player's info and the cells of the player's map
+    that were revealed since the previous time step, and it sends back the list of
+    commands issued by the AI, along with the CPU and wall time it used. Once it has
+    started and made the AI, the worker sends an empty reply, which is read with
+    ``collect`` before the first turn. The random number generator of the worker
+    is seeded from the engine's, so that seeded games remain reproducible.
+    """
+
+    def __init__(
+        self,
+        ai_factory: Callable,
+        team: str,
+        game_map: np.ndarray,
+        navigation: Navigation,
+        safe: bool,
+    ):
+        self.team = team
+        self.safe = safe
+        # Whether the process has died
+        self.dead = False
+        self.pending_cells = []
+        # The time of the last turn submitted
+        self.t = 0.0
+        # Until the worker has reported that its AI is ready
+        self.busy = True
+        context = multiprocessing.get_context("spawn")
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(
+                child_conn,
+                ai_factory,
+                team,
+                game_map.copy(),
+                navigation,
+                config.nx,
+                config.ny,
+                safe,
+                np.random.randint(2**31),
+            ),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+
+    def ready(self, watchdog: Optional[Watchdog] = None) -> bool:
+        """
+        Whether the worker can start a new turn. The commands in the late reply of
+        a turn that was given up on are discarded, but not the CPU time it used,
+        which is recorded in the ``watchdog``. An error raised by the AI is raised
+        like in ``collect``, or recorded in the ``watchdog`` if the AI ran in safe
+        mode. A worker whose process has died is never ready again.
+        """
+        if self.busy and self.conn.poll():
+            _, used, _, error = self._receive()
+            if watchdog is not None:
+                # Nothing was charged when the turn was given up on
+                watchdog.record(t=self.t, used=used)
+                if error is not None:
+                    watchdog.record_error(error)
+        return not (self.busy or self.dead)
+
+    def submit(self, t: float, dt: float, info: dict, game_map: np.ndarray):
+        cells = (
+            np.unique(np.concatenate(self.pending_cells))
+            if self.pending_cells
+            else np.zeros(0, dtype=int)
+        )
+        self.pending_cells.clear()
+        self.t = t
+        self.busy = True
+        try:
+            self.conn.send(
+                ("run", t, dt, serialize_info(info), cells, game_map.flat[cells])
+            )
+        except OSError:
+            # The process has died: this is reported when the turn is collected
+            pass
+
+    def collect(
+        self, timeout: Optional[float] = None
+    ) -> Optional[Tuple[List[Tuple], float, float, Optional[str]]]:
+        """
+        Wait for the commands of the current turn, together with the CPU and wall
+        time used and the error raised by the AI, if any. Returns ``None`` if the AI
+        did not finish within ``timeout`` seconds. If the process has died, this
+        is an error like one raised by the AI.
+        """
+        if (timeout is not None) and (not self.conn.poll(max(timeout, 0))):
+            return None
+        return self._receive()
+
+    def _receive(self) -> Tuple[List[Tuple], float, float, Optional[str]]:
+        try:
+            status, *result = self.conn.recv()
+        except (EOFError, OSError):
+            # The process died, e.g. killed by the system or by the AI itself. In
+            # safe mode, the AI is not run anymore for the rest of the match.
+            self.process.join(timeout=1)
+            self.dead = True
+            self.busy = False
+            error = f"The worker process exited with code {self.process.exitcode}"
+            if not self.safe:
+                raise RuntimeError(f"The AI of player {self.team} crashed:\n{error}")
+            return [], 0.0, 0.0, error
+        self.busy = False
+        if status == "error":
+            raise RuntimeError(f"The AI of player {self.team} crashed:\n{result[0]}")
+        return tuple(result)
+
+    def close(self):
+        if self.process.is_alive():
+            self.conn.send(("close",))
+            self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
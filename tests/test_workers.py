@@ -0,0 +1,147 @@
+# SPDX-License-Identifier: BSD-3-Clause
+
+import os
+import time
+
+import numpy as np
+import pytest
+
+from supremacy import config
+from supremacy.navigation import Navigation
+from supremacy.watchdog import Watchdog
+from supremacy.workers import BotWorker, RemoteVehicle
+
+
+class LateCrashAi:
+    def run(self, t: float, dt: float, info: dict, game_map: np.ndarray):
+        time.sleep(0.5)
+        raise ValueError("late crash")
+
+
+@pytest.fixture(autouse=True)
+def small_map(monkeypatch):
+    monkeypatch.setattr(config, "nx", 32, raising=False)
+    monkeypatch.setattr(config, "ny", 32, raising=False)
+
+
+class LateBusyAi:
+    def run(self, t: float, dt: float, info: dict, game_map: np.ndarray):
+        start = time.thread_time()
+        while time.thread_time() - start < 0.2:
+            pass
+
+
+class ExitAi:
+    def run(self, t: float, dt: float, info: dict, game_map: np.ndarray):
+        os._exit(3)
+
+
+def make_worker(safe: bool, ai_factory=LateCrashAi) -> BotWorker:
+    game_map = np.ones((32, 32), dtype=np.int8)
+    worker = BotWorker(
+        ai_factory=ai_factory,
+        team="p0",
+        game_map=game_map,
+        navigation=Navigation(game_map),
+        safe=safe,
+    )
+    assert worker.collect() == ([], 0.0, 0.0, None)
+    return worker
+
+
+def run_late_turn(worker: BotWorker):
+    worker.submit(t=1.0, dt=0.1, info={}, game_map=np.ones((32, 32), dtype=np.int8))
+    assert worker.collect(timeout=0.01) is None
+    deadline = time.perf_counter() + 30
+    while not worker.conn.poll(0.1):
+        assert time.perf_counter() < deadline
+
+
+def test_late_crash_is_raised():
+    worker = make_worker(safe=False)
+    try:
+        run_late_turn(worker)
+        with pytest.raises(RuntimeError, match="late crash"):
+            worker.ready()
+        assert not worker.busy
+    finally:
+        worker.close()
+
+
+def test_late_crash_is_recorded_in_safe_mode():
+    worker = make_worker(safe=True)
+    watchdog = Watchdog()
+    try:
+        run_late_turn(worker)
+        assert worker.ready(watchdog)
+        assert watchdog.errors == 1
+        assert "late crash" in watchdog.last_error
+    finally:
+        worker.close()
+
+
+def test_late_turn_is_charged_its_cpu_time():
+    worker = make_worker(safe=False, ai_factory=LateBusyAi)
+    watchdog = Watchdog(tick_budget=0.01)
+    try:
+        run_late_turn(worker)
+        assert worker.ready(watchdog)
+        assert watchdog.turns == 1
+        assert watchdog.total >= 0.2
+        assert watchdog.overruns[0][0] == 1.0
+    finally:
+        worker.close()
+
+
+def test_dead_worker_is_reported():
+    worker = make_worker(safe=False, ai_factory=ExitAi)
+    try:
+        worker.submit(t=0.0, dt=0.1, info={}, game_map=np.ones((32, 32), np.int8))
+        with pytest.raises(RuntimeError, match="exited with code 3"):
+            worker.collect()
+    finally:
+        worker.close()
+
+
+def test_dead_worker_is_not_run_again_in_safe_mode():
+    worker = make_worker(safe=True, ai_factory=ExitAi)
+    try:
+        worker.submit(t=0.0, dt=0.1, info={}, game_map=np.ones((32, 32), np.int8))
+        commands, _, _, error = worker.collect()
+        assert commands == []
+        assert "exited with code 3" in error
+        assert not worker.ready(Watchdog())
+    finally:
+        worker.close()
+
+
+def make_vehicle(commands: list) -> RemoteVehicle:
+    game_map = np.ones((32, 32), dtype=np.int8)
+    props = {
+        "uid": "v0",
+        "kind": "tank",
+        "x": 30.0,
+        "y": 10.0,
+        "heading": 0.0,
+        "vector": np.array([1.0, 0.0]),
+        "stopped": False,
+        "owner": {},
+    }
+    return RemoteVehicle(props, commands, Navigation(game_map))
+
+
+def test_remote_vehicle_sees_its_own_commands():
+    commands = []
+    vehicle = make_vehicle(commands)
+    vehicle.set_heading(90.0)
+    assert vehicle.heading == 90.0
+    assert vehicle["heading"] == 90.0
+    assert np.allclose(vehicle.vector, [0.0, 1.0])
+    # The shortest way to x=2 is through the periodic boundary
+    vehicle.goto(2.0, 10.0)
+    assert vehicle.heading == pytest.approx(0.0)
+    vehicle.goto(2.0, 10.0, shortest_path=False)
+    assert vehicle.heading == pytest.approx(180.0)
+    vehicle.stop()
+    assert vehicle.stopped
+    assert [c[0] for c in commands] == ["set_heading"] * 3 + ["stop"]